@@ -0,0 +1,208 @@
+import threading
+import time
+
+from collections import Counter, OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .instrumentation import phase
+
+
+# how long a generation's value is kept, letting those of replaced
+# generations drop out
+DATASET_TIMEOUT = 60 * 60 * 24 * 7
+
+# how long a rebuild may hold the lock before another worker takes over
+LOCK_TIMEOUT = 30
+
+# how long a worker with no value to serve waits for another one's rebuild
+WAIT_INTERVAL = 0.05
+
+# local counts added to the shared counters every so many reads
+STATS_FLUSH_EVERY = 100
+
+STATS = ["local_hits", "hits", "misses", "stale", "rebuilds", "rebuild_ms"]
+
+# the datasets by name
+DATASETS = {}
+
+
+class LocalCache(object):
+    """
+    The process's copies of the datasets, each under the generation it was
+    built for, evicting the least recently used ones once their pickled
+    size exceeds CACHE_L1_MAX_BYTES.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, name, generation):
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry is None:
+                return None
+            self.entries[name] = entry
+        if entry[0] == generation:
+            return entry[1]
+
+    def set(self, name, generation, value):
+        max_bytes = getattr(settings, "CACHE_L1_MAX_BYTES", 0)
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) if max_bytes else 0
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry is not None:
+                self.size -= entry[2]
+            if not 0 < size <= max_bytes:
+                return
+            self.entries[name] = (generation, value, size)
+            self.size += size
+            while self.size > max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+local = LocalCache()
+
+
+class CachedDataset(object):
+    """
+    A value built by `build` and cached under a generation number. A change
+    bumps the generation instead of deleting the value, so the first read
+    of the new generation rebuilds it while holding a short lock; other
+    workers meanwhile serve the last value built rather than rebuilding it
+    as well.
+
+    Each process also keeps the value in memory, see `LocalCache`, and
+    serves it from there for as long as the generation stays the same; the
+    value is shared, so callers must not change it.
+
+    Hits, misses, stale reads, rebuilds and the time spent on them are
+    counted in the cache, see `stats`.
+    """
+
+    def __init__(self, name, build, timeout=DATASET_TIMEOUT):
+        self.name = name
+        self.build = build
+        self.timeout = timeout
+        self.counts = Counter()
+        self.reads = 0
+        self.lock = threading.Lock()
+        DATASETS[name] = self
+
+    def key(self, *parts):
+        return ":".join([self.name] + [str(part) for part in parts])
+
+    def generation(self):
+        generation = cache.get(self.key("generation"))
+        if generation is None:
+            # starting from the time keeps a lost counter from going back to a
+            # generation that may still have a value cached
+            cache.add(self.key("generation"), int(time.time() * 1000), None)
+            generation = cache.get(self.key("generation"))
+        return generation
+
+    def invalidate(self):
+        try:
+            cache.incr(self.key("generation"))
+        except ValueError:
+            self.generation()
+
+    def get(self):
+        """
+        Return the value and the generation it was built for, which is older
+        than the current one while another worker rebuilds it.
+        """
+        generation = self.generation()
+        value = local.get(self.name, generation)
+        if value is not None:
+            self.count("local_hits")
+            return value, generation
+        value = cache.get(self.key(generation))
+        if value is not None:
+            self.count("hits")
+            local.set(self.name, generation, value)
+            return value, generation
+        self.count("misses")
+        while True:
+            if self.acquire(generation):
+                try:
+                    return self.rebuild(generation), generation
+                finally:
+                    cache.delete(self.key("lock", generation))
+            built = cache.get(self.key("built"))
+            value = self.stored(built) if built is not None else None
+            if value is not None:
+                self.count("stale")
+                return value, built
+            time.sleep(WAIT_INTERVAL)
+            value = self.stored(generation)
+            if value is not None:
+                return value, generation
+
+    def stored(self, generation):
+        value = local.get(self.name, generation)
+        if value is None:
+            value = cache.get(self.key(generation))
+            if value is not None:
+                local.set(self.name, generation, value)
+        return value
+
+    def acquire(self, generation):
+        key = self.key("lock", generation)
+        if cache.add(key, time.time() + LOCK_TIMEOUT, LOCK_TIMEOUT):
+            return True
+        expires = cache.get(key)
+        if expires is not None and expires < time.time():
+            # left behind by a worker that died before the lock expired
+            cache.delete(key)
+            return cache.add(key, time.time() + LOCK_TIMEOUT, LOCK_TIMEOUT)
+        return False
+
+    def rebuild(self, generation):
+        started = time.time()
+        with phase("build"):
+            value = self.build()
+        cache.set(self.key(generation), value, self.timeout)
+        if generation > cache.get(self.key("built"), 0):
+            cache.set(self.key("built"), generation, None)
+        local.set(self.name, generation, value)
+        self.count("rebuilds")
+        self.count("rebuild_ms", int((time.time() - started) * 1000), flush=True)
+        return value
+
+    def count(self, counter, amount=1, flush=False):
+        with self.lock:
+            self.counts[counter] += amount
+            self.reads += 1
+            if not flush and self.reads < STATS_FLUSH_EVERY:
+                return
+            counts, self.counts, self.reads = self.counts, Counter(), 0
+        for counter, amount in counts.items():
+            key = self.key("stats", counter)
+            cache.add(key, 0, None)
+            cache.incr(key, amount)
+
+    def stats(self):
+        """
+        The counters of all workers, with this one's latest counts.
+        """
+        stored = cache.get_many([self.key("stats", counter) for counter in STATS])
+        with self.lock:
+            return {
+                counter: stored.get(self.key("stats", counter), 0) + self.counts[counter]
+                for counter in STATS
+            }
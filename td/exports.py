@@ -0,0 +1,108 @@
+import gzip
+import io
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .search import langnames, names_data
+
+
+# how long the artifacts of a data version are kept, long enough to outlast
+# any version while letting those of replaced versions drop out
+EXPORT_TIMEOUT = 60 * 60 * 24 * 7
+
+# the encodings artifacts are stored in, preferred first
+ENCODINGS = ["br", "gzip", "identity"]
+
+
+def _codes_text(value):
+    return " ".join(x["lc"] for x in names_data(value)).encode("utf-8")
+
+
+def _names_text(value):
+    return b"\n".join(b"\t".join([x["lc"].encode("utf-8"), x["ln"]]) for x in names_data(value))
+
+
+def _names_json(value):
+    return value["json"]
+
+
+# the content type of each export and how it is rendered from a value of `langnames`
+EXPORTS = {
+    "codes-d43.txt": ("text/plain", _codes_text),
+    "langnames.txt": ("text/plain", _names_text),
+    "langnames.json": ("application/json", _names_json),
+}
+
+
+def _key(name, version, part):
+    return "exports:{0}:{1}:{2}".format(name, version, part)
+
+
+def _encode(content):
+    encoded = {"identity": content}
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as fp:
+        fp.write(content)
+    encoded["gzip"] = buf.getvalue()
+    if brotli is not None:
+        encoded["br"] = brotli.compress(content, mode=brotli.MODE_TEXT)
+    return encoded
+
+
+def export_artifact(name):
+    """
+    The metadata of export `name` for the generation of the language list
+    being served, which lags the current one while it is rebuilt. The
+    export is rendered from the cached list once per generation and stored
+    with its gzip and, if the brotli package is installed, brotli variants.
+    """
+    value, version = langnames.get()
+    artifact = cache.get(_key(name, version, "meta"))
+    if artifact is None:
+        content_type, render = EXPORTS[name]
+        encoded = _encode(render(value))
+        artifact = {
+            "name": name,
+            "version": version,
+            "content_type": content_type,
+            "modified": timezone.now(),
+            "encodings": [encoding for encoding in ENCODINGS if encoding in encoded],
+        }
+        stored = {_key(name, version, encoding): body for encoding, body in encoded.items()}
+        stored[_key(name, version, "meta")] = artifact
+        cache.set_many(stored, EXPORT_TIMEOUT)
+    return artifact
+
+
+def export_body(artifact, encoding):
+    """
+    The content of `artifact` in `encoding`, rendered again if it has left
+    the cache.
+    """
+    body = cache.get(_key(artifact["name"], artifact["version"], encoding))
+    if body is None:
+        body = _encode(EXPORTS[artifact["name"]][1](langnames.get()[0]))[encoding]
+    return body
+
+
+def accepted_encoding(request, encodings):
+    """
+    The first of `encodings` the request's Accept-Encoding allows.
+    """
+    accepted = set()
+    for value in request.META.get("HTTP_ACCEPT_ENCODING", "").replace(" ", "").lower().split(","):
+        encoding, _, quality = value.partition(";q=")
+        try:
+            if encoding and float(quality or 1) > 0:
+                accepted.add(encoding)
+        except ValueError:
+            pass
+    for encoding in encodings:
+        if encoding == "identity" or encoding in accepted or "*" in accepted:
+            return encoding
@@ -1,60 +1,169 @@
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.utils import timezone
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
 from pinax.eventlog.models import log
 
 
+def pooled_session(pool_size):
+    """
+    Return a `requests.Session` whose connection pool can serve `pool_size`
+    concurrent downloads.
+    """
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 class Fetcher(object):
+    """
+    Downloads `url`. When a snapshot directory is configured (see
+    IMPORTS_SNAPSHOT_DIR) the last loaded payload is kept there as
+    `filename`, together with its ETag, Last-Modified and content hash, and
+    used to make conditional requests: `fetch()` returns None and sets
+    `unchanged` when the source has not changed since that snapshot.
+
+    With `replay_dir` the payload is read from `filename` in that directory
+    instead of the network, e.g. a copy of another machine's snapshots.
+    """
 
     url = None
+    filename = None
 
-    def __init__(self, session):
+    def __init__(self, session, snapshot_dir=None, force=False, replay_dir=None):
         self.session = session
+        self.snapshot_dir = snapshot_dir or getattr(settings, "IMPORTS_SNAPSHOT_DIR", None)
+        self.force = force
+        self.replay_dir = replay_dir
+        self.response = None
+        self.unchanged = False
+
+    @property
+    def snapshot_path(self):
+        if self.snapshot_dir:
+            return os.path.join(self.snapshot_dir, self.filename)
+
+    def snapshot(self):
+        if self.force or not self.snapshot_path or not os.path.exists(self.snapshot_path + ".json"):
+            return {}
+        with open(self.snapshot_path + ".json") as fp:
+            return json.load(fp)
+
+    def replay(self):
+        path = os.path.join(self.replay_dir, self.filename)
+        if not os.path.exists(path):
+            log(
+                user=None,
+                action=self.error_action_label,
+                extra={"status_code": None, "text": "No snapshot at {0}".format(path)}
+            )
+            return None
+        with open(path, "rb") as fp:
+            return fp.read()
 
     def fetch(self):
-        response = self.session.get(self.url)
+        if self.replay_dir:
+            return self.replay()
+        snapshot = self.snapshot()
+        headers = {}
+        if snapshot.get("etag"):
+            headers["If-None-Match"] = snapshot["etag"]
+        if snapshot.get("last_modified"):
+            headers["If-Modified-Since"] = snapshot["last_modified"]
+        response = self.session.get(self.url, headers=headers)
+        if response.status_code == 304:
+            self.unchanged = True
+            return None
         if response.status_code != 200:
             log(
                 user=None,
                 action=self.error_action_label,
                 extra={"status_code": response.status_code, "text": response.content}
             )
+            return response.content
+        if snapshot.get("sha1") == hashlib.sha1(response.content).hexdigest():
+            self.unchanged = True
+            return None
+        self.response = response
         return response.content
 
+    def store(self):
+        """
+        Record the payload returned by `fetch()` as the new snapshot; call
+        this once it has been loaded successfully.
+        """
+        if self.response is None or not self.snapshot_path:
+            return
+        if not os.path.isdir(self.snapshot_dir):
+            os.makedirs(self.snapshot_dir)
+        metadata = {
+            "url": self.url,
+            "etag": self.response.headers.get("ETag"),
+            "last_modified": self.response.headers.get("Last-Modified"),
+            "sha1": hashlib.sha1(self.response.content).hexdigest(),
+            "fetched_at": timezone.now().isoformat()
+        }
+        files = [
+            (self.snapshot_path, self.response.content),
+            (self.snapshot_path + ".json", json.dumps(metadata))
+        ]
+        for path, data in files:
+            with open(path + ".tmp", "wb") as fp:
+                fp.write(data)
+            os.rename(path + ".tmp", path)
+
 
 class WikipediaFetcher(Fetcher):
 
     url = "http://en.wikipedia.org/wiki/List_of_ISO_639-1_codes"
+    filename = "wikipedia.html"
     error_action_label = "SOURCE_WIKIPEDIA_RELOAD_FAILED"
 
 
 class WikipediaCountryFetcher(Fetcher):
     url = "http://en.wikipedia.org/wiki/ISO_3166-1"
+    filename = "wikipedia_country.html"
     error_action_label = "SOURCE_WIKIPEDIA_COUNTRIES_FAILED"
 
 
 class ISO_639_3Fetcher(Fetcher):
 
     url = "http://www-01.sil.org/iso639-3/iso-639-3.tab"
+    filename = "iso_639_3.tab"
     error_action_label = "SOURCE_SIL_ISO_639_3_RELOAD_FAILED"
 
 
 class EthnologueLanguageCodesFetcher(Fetcher):
 
     url = "http://www.ethnologue.com/sites/default/files/LanguageCodes.tab"
+    filename = "LanguageCodes.tab"
     error_action_label = "SOURCE_ETHNOLOGUE_LANG_CODE_RELOAD_FAILED"
 
 
 class EthnologueCountryCodesFetcher(Fetcher):
 
     url = "http://www.ethnologue.com/sites/default/files/CountryCodes.tab"
+    filename = "CountryCodes.tab"
     error_action_label = "SOURCE_ETHNOLOGUE_COUNTRY_CODE_RELOAD_FAILED"
 
 
 class EthnologueLanguageIndexFetcher(Fetcher):
 
     url = "http://www.ethnologue.com/sites/default/files/LanguageIndex.tab"
+    filename = "LanguageIndex.tab"
     error_action_label = "SOURCE_ETHNOLOGUE_LANG_INDEX_RELOAD_FAILED"
 
 
 class IMBPeopleFetcher(Fetcher):
 
     url = "http://public.imb.org/globalresearch/Documents/GSEC2015-01/2015-01_GSEC_Listing_of_People_Groups.xls"
+    filename = "imb_people_groups.xls"
     error_action_label = "SOURCE_IMB_PEOPLE_GROUPS_RELOAD_FAILED"
@@ -0,0 +1,363 @@
+import hashlib
+import re
+
+from collections import OrderedDict
+from decimal import Decimal
+from itertools import islice
+
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils.encoding import force_bytes, force_text
+
+from td.instrumentation import phase
+
+
+BATCH_SIZE = 1000
+
+# records per UPDATE ... CASE statement outside PostgreSQL, kept small as the
+# statement has a WHEN per record for every field
+CASE_BATCH_SIZE = 100
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def ibatches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class CopyStream(object):
+    """
+    File-like object feeding rows to ``COPY ... FROM STDIN`` in the text
+    format, encoding them as they are read instead of building the whole
+    payload up front.
+    """
+
+    ESCAPES = [("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r")]
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b""
+
+    @classmethod
+    def encode(cls, value):
+        if value is None:
+            return b"\\N"
+        value = force_bytes(value)
+        for char, escaped in cls.ESCAPES:
+            value = value.replace(char, escaped)
+        return value
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += b"\t".join(self.encode(value) for value in row) + b"\n"
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def bulk_update(model, updates, fields, batch_size=BATCH_SIZE):
+    """
+    Write `updates`, a list of (pk, values) pairs, rather than saving one
+    record at a time. On PostgreSQL each batch is copied into a temporary
+    table and written with a single UPDATE ... FROM; other backends use one
+    UPDATE ... CASE statement per CASE_BATCH_SIZE records.
+    """
+    if not updates or not fields:
+        return
+    model_fields = [model._meta.get_field(name) for name in fields]
+    if connection.vendor == "postgresql":
+        with transaction.atomic():
+            _update_from_staging(
+                connection.cursor(),
+                model._meta.db_table,
+                model._meta.pk.column,
+                [field.column for field in model_fields],
+                (
+                    [[pk] + [field.get_db_prep_save(values[field.name], connection) for field in model_fields]
+                     for pk, values in batch]
+                    for batch in batches(updates, batch_size)
+                )
+            )
+        return
+    # each record binds its pk once for the filter and a pk/value pair per field
+    size = connection.ops.bulk_batch_size(["pk"] + fields * 2, updates)
+    for batch in batches(updates, max(1, min(CASE_BATCH_SIZE, size))):
+        model.objects.filter(pk__in=[pk for pk, _ in batch]).update(**{
+            field.name: Case(
+                *[When(pk=pk, then=Value(values[field.name])) for pk, values in batch],
+                # the column as default gives the CASE its type even when every value is NULL
+                default=F(field.name),
+                output_field=field
+            )
+            for field in model_fields
+        })
+
+
+def _staging_table(table):
+    return "{0}_updates".format(table)
+
+
+def _update_from_staging(cursor, table, pk, columns, row_batches):
+    """
+    Update `columns` of `table` from `row_batches`, lists of rows of the `pk`
+    and `columns` values, by copying each batch into a temporary table and
+    joining it in one UPDATE ... FROM. The temporary table is dropped once
+    done; if this fails, it goes with the rollback of the transaction, or
+    outside one must be dropped by the caller.
+    """
+    qn = connection.ops.quote_name
+    staging = qn(_staging_table(table))
+    column_list = ", ".join(qn(column) for column in [pk] + columns)
+    cursor.execute("CREATE TEMPORARY TABLE {0} AS SELECT {1} FROM {2} WITH NO DATA".format(
+        staging, column_list, qn(table)
+    ))
+    for rows in row_batches:
+        cursor.copy_expert("COPY {0} ({1}) FROM STDIN".format(staging, column_list), CopyStream(rows))
+        cursor.execute("UPDATE {0} SET {1} FROM {2} WHERE {0}.{3} = {2}.{3}".format(
+            qn(table),
+            ", ".join("{0} = {1}.{0}".format(qn(column), staging) for column in columns),
+            staging,
+            qn(pk)
+        ))
+        cursor.execute("TRUNCATE {0}".format(staging))
+    cursor.execute("DROP TABLE {0}".format(staging))
+
+
+def normalize(field, value):
+    """
+    Bring a parsed or stored value of `field` to the same text form so the
+    two can be compared, e.g. 1.5 and Decimal("1.500000") for a
+    DecimalField with six decimal places.
+    """
+    value = field.to_python(value)
+    if value is None:
+        return None
+    if isinstance(field, models.DecimalField):
+        value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+    return force_text(value)
+
+
+def row_hash(model_fields, values):
+    digest = hashlib.sha1()
+    for field, value in zip(model_fields, values):
+        value = normalize(field, value)
+        digest.update(b"\x00" if value is None else b"\x01" + force_bytes(value))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class RowDiff(object):
+    """
+    The changes needed to bring a table in line with a set of parsed rows:
+    `inserts` are row dicts, `updates` are (pk, row) pairs and `deletes`
+    are pks, with the `key` values of the deleted records in
+    `deleted_keys`; `unchanged` counts the rows that are already up to date.
+    """
+
+    def __init__(self, key, fields):
+        self.key = key
+        self.fields = fields
+        self.inserts = []
+        self.updates = []
+        self.deletes = []
+        self.deleted_keys = []
+        self.unchanged = 0
+
+    def __len__(self):
+        return len(self.inserts) + len(self.updates) + len(self.deletes)
+
+    def keys(self):
+        """
+        The `key` values of every inserted, updated or deleted record.
+        """
+        keys = set(self.deleted_keys)
+        keys.update(row[self.key] for row in self.inserts)
+        keys.update(row[self.key] for _, row in self.updates)
+        return keys
+
+    def counts(self):
+        return {
+            "rows_created": len(self.inserts),
+            "rows-updated": len(self.updates),
+            "rows_deleted": len(self.deletes),
+            "rows_unchanged": self.unchanged
+        }
+
+
+def diff_rows(model, key, rows, delete=True):
+    """
+    Compare `rows` (dicts of field values, including `key`) with the stored
+    records of `model` by hashing the values of each and return a RowDiff.
+
+    A key repeated in `rows` keeps its last values. Stored records whose key
+    is not in `rows` are deleted, unless `rows` is empty or `delete` is
+    False.
+    """
+    with phase("diff") as timed:
+        pending = OrderedDict((row[key], row) for row in rows)
+        fields = [name for name in next(iter(pending.values()), {}) if name != key]
+        model_fields = [model._meta.get_field(name) for name in fields]
+        diff = RowDiff(key, fields)
+        stored = {}
+        for values in model.objects.values_list("pk", key, *fields):
+            stored[values[1]] = (values[0], row_hash(model_fields, values[2:]))
+        for k, row in pending.items():
+            if k not in stored:
+                diff.inserts.append(row)
+            elif stored[k][1] != row_hash(model_fields, [row[name] for name in fields]):
+                diff.updates.append((stored[k][0], row))
+            else:
+                diff.unchanged += 1
+        if pending and delete:
+            diff.deleted_keys = [k for k in stored if k not in pending]
+            diff.deletes = [stored[k][0] for k in diff.deleted_keys]
+        timed.rows = len(pending)
+    return diff
+
+
+def apply_diff(model, diff, batch_size=BATCH_SIZE):
+    with phase("write", rows=len(diff)), transaction.atomic():
+        model.objects.bulk_create([model(**row) for row in diff.inserts], batch_size=batch_size)
+        bulk_update(model, diff.updates, diff.fields, batch_size=batch_size)
+        for batch in batches(diff.deletes, batch_size):
+            model.objects.filter(pk__in=batch).delete()
+
+
+def sync_rows(model, key, rows, batch_size=BATCH_SIZE, delete=True):
+    """
+    Make the table of `model` match `rows`, writing only the records that
+    were added, changed or removed. Returns the applied RowDiff.
+    """
+    diff = diff_rows(model, key, rows, delete=delete)
+    if diff:
+        apply_diff(model, diff, batch_size=batch_size)
+    return diff
+
+
+def swap_rows(model, key, rows):
+    """
+    Like `sync_rows`, but on PostgreSQL the changes are written to a shadow
+    copy of the table which then replaces the live one in a short
+    transaction that only renames tables, so readers never see a partially
+    written table and the live table is not locked while it is rebuilt.
+    Unchanged and updated records keep their primary keys.
+    """
+    diff = diff_rows(model, key, rows)
+    if diff and connection.vendor == "postgresql":
+        with phase("write", rows=len(diff)):
+            _swap_postgresql(model, diff)
+    elif diff:
+        apply_diff(model, diff)
+    return diff
+
+
+def _indexes(cursor, table):
+    """
+    Map each index of `table`, by its definition with the index and table
+    names left out, to its name.
+    """
+    cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [table])
+    return {
+        re.sub(r"INDEX \S+ ON \S+ ", "INDEX ON ", indexdef): name
+        for name, indexdef in cursor.fetchall()
+    }
+
+
+def _swap_postgresql(model, diff):
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    shadow = "{0}_shadow".format(table)
+    pk = model._meta.pk.column
+    columns = [model._meta.get_field(name).column for name in diff.fields]
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE IF EXISTS {0}".format(qn(shadow)))
+    cursor.execute("CREATE TABLE {0} (LIKE {1} INCLUDING ALL)".format(qn(shadow), qn(table)))
+    try:
+        cursor.execute("INSERT INTO {0} SELECT * FROM {1} WHERE NOT ({2} = ANY(%s))".format(
+            qn(shadow), qn(table), qn(pk)
+        ), [diff.deletes])
+        if diff.updates:
+            _update_from_staging(cursor, shadow, pk, columns, [
+                [[pk_value] + [row[name] for name in diff.fields] for pk_value, row in diff.updates]
+            ])
+        if diff.inserts:
+            fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+            cursor.copy_expert(
+                "COPY {0} ({1}) FROM STDIN".format(qn(shadow), ", ".join(qn(field.column) for field in fields)),
+                CopyStream(
+                    [getattr(obj, field.attname) for field in fields]
+                    for obj in (model(**row) for row in diff.inserts)
+                )
+            )
+        with transaction.atomic():
+            cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [table, pk])
+            sequence = cursor.fetchone()[0]
+            live_indexes = _indexes(cursor, table)
+            cursor.execute("ALTER TABLE {0} RENAME TO {1}".format(qn(table), qn("{0}_old".format(table))))
+            cursor.execute("ALTER TABLE {0} RENAME TO {1}".format(qn(shadow), qn(table)))
+            if sequence:
+                cursor.execute("ALTER SEQUENCE {0} OWNED BY {1}.{2}".format(sequence, qn(table), qn(pk)))
+            cursor.execute("DROP TABLE {0}".format(qn("{0}_old".format(table))))
+            for definition, name in _indexes(cursor, table).items():
+                if live_indexes.get(definition, name) != name:
+                    cursor.execute("ALTER INDEX {0} RENAME TO {1}".format(qn(name), qn(live_indexes[definition])))
+    except Exception:
+        # inside an outer transaction the tables go with its rollback
+        if not connection.in_atomic_block:
+            cursor.execute("DROP TABLE IF EXISTS {0}".format(qn(_staging_table(shadow))))
+            cursor.execute("DROP TABLE IF EXISTS {0}".format(qn(shadow)))
+        raise
+
+
+def copy_replace(model, fields, rows):
+    """
+    Replace the whole contents of `model`'s table with `rows`, tuples of
+    values ordered as `fields`, in a single transaction.
+
+    On PostgreSQL the rows are streamed with COPY into a temporary staging
+    table and swapped in with one DELETE and one INSERT ... SELECT; other
+    backends fall back to chunked multi-row inserts.
+
+    Returns a (rows_deleted, rows_created) tuple.
+    """
+    with phase("write") as timed, transaction.atomic():
+        rows_deleted = model.objects.count()
+        if connection.vendor == "postgresql":
+            rows_created = _copy_replace_postgresql(model, fields, rows)
+        else:
+            model.objects.all().delete()
+            rows_created = 0
+            for batch in ibatches(rows, BATCH_SIZE):
+                model.objects.bulk_create([model(**dict(zip(fields, row))) for row in batch])
+                rows_created += len(batch)
+        timed.rows = rows_deleted + rows_created
+    return rows_deleted, rows_created
+
+
+def _copy_replace_postgresql(model, fields, rows):
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    staging = qn("{0}_staging".format(model._meta.db_table))
+    columns = ", ".join(qn(model._meta.get_field(name).column) for name in fields)
+    cursor = connection.cursor()
+    cursor.execute("CREATE TEMPORARY TABLE {0} AS SELECT {1} FROM {2} WITH NO DATA".format(
+        staging, columns, table
+    ))
+    cursor.copy_expert("COPY {0} ({1}) FROM STDIN".format(staging, columns), CopyStream(rows))
+    cursor.execute("DELETE FROM {0}".format(table))
+    cursor.execute("INSERT INTO {0} ({1}) SELECT {1} FROM {2}".format(table, columns, staging))
+    rows_created = cursor.rowcount
+    cursor.execute("DROP TABLE {0}".format(staging))
+    return rows_created
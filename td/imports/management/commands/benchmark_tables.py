@@ -0,0 +1,56 @@
+import os
+import timeit
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+import bs4
+
+from ...tables import PARSER, table_rows
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "tests", "data")
+FIXTURES = [
+    ("wikipedia.html", "wikitable"),
+    ("wikipedia_country.html", "sortable"),
+]
+
+
+def full_parse(content, css_class):
+    soup = bs4.BeautifulSoup(content, "html.parser")
+    return [[td.text for td in tr.find_all("td")] for tr in soup.select("table.{0} tr".format(css_class))]
+
+
+def strained_parse(content, css_class, parser):
+    return list(table_rows(content, css_class, parser=parser))
+
+
+class Command(BaseCommand):
+    help = "compare parsing the Wikipedia fixtures whole with the table strainer"
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--repeat",
+            dest="repeat",
+            type="int",
+            default=5,
+            help="Number of timed runs per case; the best is reported"
+        ),
+    )
+
+    def handle(self, *args, **options):
+        parsers = sorted({"html.parser", PARSER})
+        for filename, css_class in FIXTURES:
+            content = open(os.path.join(DATA_DIR, filename), "rb").read()
+            expected = full_parse(content, css_class)
+            baseline = min(timeit.repeat(lambda: full_parse(content, css_class), number=1, repeat=options["repeat"]))
+            self.stdout.write("{0:<24} {1:<28} {2:>8.3f}s".format(filename, "full soup, html.parser", baseline))
+            for parser in parsers:
+                if strained_parse(content, css_class, parser) != expected:
+                    self.stderr.write("{0}: {1} rows differ from the full parse".format(filename, parser))
+                elapsed = min(timeit.repeat(
+                    lambda: strained_parse(content, css_class, parser), number=1, repeat=options["repeat"]
+                ))
+                self.stdout.write("{0:<24} {1:<28} {2:>8.3f}s {3:>6.1f}x".format(
+                    filename, "strained, {0}".format(parser), elapsed, baseline / elapsed
+                ))
@@ -1,19 +1,118 @@
+import time
+
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
 from django.core.management.base import BaseCommand
+from django.db import connection
 
 import requests
 
 from ... import models
+from ...fetch import pooled_session
+from ...tasks import start_reload
+from td.instrumentation import instrumented
 from td.tasks import update_countries_from_imports, integrate_imports
 
 
+MAX_WORKERS = 4
+
+
+def download(fetcher):
+    start = time.time()
+    try:
+        content, error = fetcher.fetch(), None
+    except requests.RequestException as e:
+        content, error = None, e
+    finally:
+        connection.close()  # failed fetches are logged from this worker thread
+    return fetcher, content, error, time.time() - start
+
+
 class Command(BaseCommand):
     help = "reload all imports"
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--force",
+            action="store_true",
+            dest="force",
+            default=False,
+            help="Download and load every source even if unchanged since its last snapshot"
+        ),
+        make_option(
+            "--from-snapshots",
+            dest="from_snapshots",
+            default=None,
+            metavar="DIR",
+            help="Load the sources from the payloads saved in DIR instead of downloading them"
+        ),
+        make_option(
+            "--celery",
+            action="store_true",
+            dest="celery",
+            default=False,
+            help="Queue one Celery task per source and the integrations after them instead of running here"
+        ),
+        make_option(
+            "--full",
+            action="store_true",
+            dest="full",
+            default=False,
+            help="Integrate every language rather than only those affected by the reloaded records"
+        ),
+    )
 
     def handle(self, *args, **options):
-        session = requests.Session()
-        for obj in models.__dict__.values():
-            if hasattr(obj, "reload") and callable(obj.reload):
-                print "Loading {} records".format(obj._meta.verbose_name)
-                obj.reload(session)
-        update_countries_from_imports()
-        integrate_imports()
+        if options["celery"]:
+            for result in start_reload(force=options["force"], full=options["full"]):
+                self.stdout.write("Queued {}".format(result.id))
+            return
+        with instrumented("reload_imports") as instrument:
+            sources = models.import_sources()
+            workers = min(MAX_WORKERS, len(sources))
+            session = None if options["from_snapshots"] else pooled_session(workers)
+            pool = ThreadPool(workers)
+            fetchers = {
+                source.fetcher_class(session, force=options["force"], replay_dir=options["from_snapshots"]): source
+                for source in sources
+            }
+            timings = []
+            changes = models.changes()
+            try:
+                # sources are loaded on this thread, one at a time, as their downloads complete
+                for fetcher, content, error, download_time in pool.imap_unordered(download, fetchers):
+                    source = fetchers[fetcher]
+                    start = time.time()
+                    status = self.load(source, fetcher, content, error, changes)
+                    timings.append((source._meta.verbose_name, download_time, time.time() - start, status))
+                    # downloads run on the pool's threads, outside the run's phases
+                    instrument.record("fetch", download_time)
+            finally:
+                pool.close()
+                pool.join()
+            update_countries_from_imports()
+            if options["full"]:
+                integrate_imports()
+            else:
+                integrate_imports(**changes)
+        self.stdout.write("{:<40} {:>10} {:>10}  {}".format("Source", "Download", "Load", "Status"))
+        for name, download_time, load_time, status in timings:
+            self.stdout.write("{:<40} {:>9.2f}s {:>9.2f}s  {}".format(name, download_time, load_time, status))
+
+    def load(self, source, fetcher, content, error, changes):
+        """
+        Load a downloaded source, adding what it changed to `changes`, and
+        return its status.
+        """
+        if error is not None:
+            self.stderr.write("Failed to download {}: {}".format(source._meta.verbose_name, error))
+            return "failed"
+        if fetcher.unchanged:
+            return "unchanged"
+        if not content:
+            return "empty"
+        self.stdout.write("Loading {} records".format(source._meta.verbose_name))
+        for kind, values in source.load(content).items():
+            changes[kind].update(values)
+        fetcher.store()
+        return "loaded"
@@ -1,4 +1,8 @@
 import csv
+import resource
+import time
+
+from collections import OrderedDict
 
 try:
     from cStringIO import StringIO
@@ -7,19 +11,58 @@ except ImportError:
 
 from django.db import models
 from django.utils import timezone
-from django.utils.encoding import python_2_unicode_compatible
+from django.utils.encoding import force_text, python_2_unicode_compatible
 
+from td.instrumentation import instrumented, phase
 from td.utils import str_to_bool
 
-import bs4
 import xlrd
 
 from pinax.eventlog.models import log
 from . import fetch
+from .loaders import copy_replace, swap_rows, sync_rows
+from .tables import table_rows
+
+
+class ImportSource(object):
+    """
+    Mixin for the import models: `reload` downloads the source with
+    `fetcher_class` and hands the payload to `load`, skipping it entirely
+    when the fetcher reports the source unchanged since its last snapshot.
+    """
+
+    fetcher_class = None
+
+    @classmethod
+    def reload(cls, session):
+        with instrumented("reload:{0}".format(cls.__name__)):
+            fetcher = cls.fetcher_class(session)
+            with phase("fetch"):
+                content = fetcher.fetch()
+            if content:
+                changes = cls.load(content)
+                fetcher.store()
+                return changes
+
+    @classmethod
+    def load(cls, content):
+        """
+        Load `content` into the table and return the change set for
+        integration, see `changes`.
+        """
+        raise NotImplementedError()
+
+
+def changes(codes=(), country_codes=()):
+    """
+    A change set: the language codes (ISO 639-3 or 639-1) and country codes
+    whose integrated languages may be affected by a reload.
+    """
+    return {"codes": set(codes), "country_codes": set(country_codes)}
 
 
 @python_2_unicode_compatible
-class WikipediaISOCountry(models.Model):
+class WikipediaISOCountry(ImportSource, models.Model):
     english_short_name = models.CharField(max_length=100)
     alpha_2 = models.CharField(max_length=2)
     alpha_3 = models.CharField(max_length=3)
@@ -33,30 +76,30 @@ class WikipediaISOCountry(models.Model):
         verbose_name = "Wikipedia ISO 3166-1 Country"
         verbose_name_plural = "Wikipedia ISO 3166-1 Countries"
 
+    fetcher_class = fetch.WikipediaCountryFetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.WikipediaCountryFetcher(session).fetch()
-        if not content:
-            return
-        soup = bs4.BeautifulSoup(content)
-        records = []
-        for tr in soup.select("table.sortable tr"):
-            row = [td.text for td in tr.find_all("td")]
-            if len(row) == 5:
-                records.append(cls(
-                    english_short_name=row[0].strip(),
-                    alpha_2=row[1].strip(),
-                    alpha_3=row[2].strip(),
-                    numeric_code=row[3].strip(),
-                    iso_3166_2_code=row[4].strip()
-                ))
+    def load(cls, content):
+        with phase("parse") as timed:
+            records = []
+            for row in table_rows(content, "sortable"):
+                if len(row) == 5:
+                    records.append(dict(
+                        english_short_name=row[0].strip(),
+                        alpha_2=row[1].strip(),
+                        alpha_3=row[2].strip(),
+                        numeric_code=row[3].strip(),
+                        iso_3166_2_code=row[4].strip()
+                    ))
+            timed.rows = len(records)
         if len(records) > 0:
-            cls.objects.all().delete()
-            cls.objects.bulk_create(records)
-            log(user=None, action="SOURCE_WIKIPEDIA_COUNTRIES_RELOADED", extra={})
+            diff = swap_rows(cls, "alpha_2", records)
+            log(user=None, action="SOURCE_WIKIPEDIA_COUNTRIES_RELOADED", extra=diff.counts())
+            return changes(country_codes=diff.keys())
+        return changes()
 
 
-class WikipediaISOLanguage(models.Model):
+class WikipediaISOLanguage(ImportSource, models.Model):
 
     language_family = models.CharField(max_length=100)
     language_name = models.CharField(max_length=100)
@@ -78,34 +121,36 @@ class WikipediaISOLanguage(models.Model):
     class Meta:
         verbose_name = "Wikipedia ISO Language"
 
+    fetcher_class = fetch.WikipediaFetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.WikipediaFetcher(session).fetch()
-        if not content:
-            return
-        soup = bs4.BeautifulSoup(content)
-        records = []
-        for tr in soup.select("table.wikitable tr"):
-            row = [td.text for td in tr.find_all("td")]
-            if len(row) == 10:
-                records.append(cls(
-                    language_family=row[1].strip(),
-                    language_name=row[2].strip(),
-                    native_name=row[3].strip(),
-                    iso_639_1=row[4][:2].strip(),
-                    iso_639_2t=row[5][:3].strip(),
-                    iso_639_2b=row[6][:3].strip(),
-                    iso_639_3=row[7][:3].strip(),
-                    iso_639_9=row[8][:4].strip(),
-                    notes=row[9].strip()
-                ))
+    def load(cls, content):
+        with phase("parse") as timed:
+            records = []
+            for row in table_rows(content, "wikitable"):
+                if len(row) == 10:
+                    records.append(dict(
+                        language_family=row[1].strip(),
+                        language_name=row[2].strip(),
+                        native_name=row[3].strip(),
+                        iso_639_1=row[4][:2].strip(),
+                        iso_639_2t=row[5][:3].strip(),
+                        iso_639_2b=row[6][:3].strip(),
+                        iso_639_3=row[7][:3].strip(),
+                        iso_639_9=row[8][:4].strip(),
+                        notes=row[9].strip()
+                    ))
+            timed.rows = len(records)
         if len(records) > 0:
-            cls.objects.all().delete()
-            cls.objects.bulk_create(records)
-            log(user=None, action="SOURCE_WIKIPEDIA_RELOADED", extra={})
+            diff = swap_rows(cls, "iso_639_1", records)
+            log(user=None, action="SOURCE_WIKIPEDIA_RELOADED", extra=diff.counts())
+            # languages also pick their native name by ISO 639-3 code
+            rows = diff.inserts + [row for _, row in diff.updates]
+            return changes(codes=diff.keys() | {row["iso_639_3"] for row in rows if row["iso_639_3"]})
+        return changes()
 
 
-class SIL_ISO_639_3(models.Model):
+class SIL_ISO_639_3(ImportSource, models.Model):
 
     SCOPE_INDIVIDUAL = "I"
     SCOPE_MACRO_LANGUAGE = "M"
@@ -150,41 +195,32 @@ class SIL_ISO_639_3(models.Model):
     class Meta:
         verbose_name = "SIL ISO Code Set"
 
+    fetcher_class = fetch.ISO_639_3Fetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.ISO_639_3Fetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         reader = csv.DictReader(StringIO(content), dialect="excel-tab")
-        rows_updated = rows_created = 0
-        for row in reader:
-            defaults = dict(
-                part_2b=row["Part2B"] or "",
-                part_2t=row["Part2T"] or "",
-                part_1=row["Part1"] or "",
-                scope=row["Scope"],
-                language_type=row["Language_Type"],
-                ref_name=row["Ref_Name"],
-                comment=row["Comment"] or ""
-            )
-            record, created = cls.objects.get_or_create(
-                code=row["Id"],
-                defaults=defaults
-            )
-            if created:
-                rows_created += 1
-            else:
-                for key in defaults:
-                    setattr(record, key, defaults[key])
-                record.save()
-                rows_updated += 1
-        log(user=None, action="SOURCE_SIL_ISO_639_3_RELOADED", extra={
-            "rows_created": rows_created,
-            "rows-updated": rows_updated
-        })
-
-
-class EthnologueLanguageCode(models.Model):
+        with phase("parse") as timed:
+            rows = [
+                dict(
+                    code=row["Id"],
+                    part_2b=row["Part2B"] or "",
+                    part_2t=row["Part2T"] or "",
+                    part_1=row["Part1"] or "",
+                    scope=row["Scope"],
+                    language_type=row["Language_Type"],
+                    ref_name=row["Ref_Name"],
+                    comment=row["Comment"] or ""
+                )
+                for row in reader
+            ]
+            timed.rows = len(rows)
+        diff = sync_rows(cls, "code", rows)
+        log(user=None, action="SOURCE_SIL_ISO_639_3_RELOADED", extra=diff.counts())
+        return changes(codes=diff.keys())
+
+
+class EthnologueLanguageCode(ImportSource, models.Model):
 
     STATUS_EXTINCT = "E"
     STATUS_LIVING = "L"
@@ -208,37 +244,28 @@ class EthnologueLanguageCode(models.Model):
     class Meta:
         verbose_name = "Ethnologue Language Code"
 
+    fetcher_class = fetch.EthnologueLanguageCodesFetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.EthnologueLanguageCodesFetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         reader = csv.DictReader(StringIO(content), dialect="excel-tab")
-        rows_updated = rows_created = 0
-        for row in reader:
-            defaults = dict(
-                country_code=row["CountryID"],
-                status=row["LangStatus"],
-                name=row["Name"],
-            )
-            record, created = cls.objects.get_or_create(
-                code=row["LangID"],
-                defaults=defaults
-            )
-            if created:
-                rows_created += 1
-            else:
-                for key in defaults:
-                    setattr(record, key, defaults[key])
-                record.save()
-                rows_updated += 1
-        log(user=None, action="SOURCE_ETHNOLOGUE_LANG_CODE_RELOADED", extra={
-            "rows_created": rows_created,
-            "rows-updated": rows_updated
-        })
-
-
-class EthnologueCountryCode(models.Model):
+        with phase("parse") as timed:
+            rows = [
+                dict(
+                    code=row["LangID"],
+                    country_code=row["CountryID"],
+                    status=row["LangStatus"],
+                    name=row["Name"],
+                )
+                for row in reader
+            ]
+            timed.rows = len(rows)
+        diff = sync_rows(cls, "code", rows)
+        log(user=None, action="SOURCE_ETHNOLOGUE_LANG_CODE_RELOADED", extra=diff.counts())
+        return changes(codes=diff.keys())
+
+
+class EthnologueCountryCode(ImportSource, models.Model):
 
     code = models.CharField(max_length=2, unique=True)
     name = models.CharField(max_length=75)
@@ -254,36 +281,27 @@ class EthnologueCountryCode(models.Model):
     class Meta:
         verbose_name = "Ethnologue Country Code"
 
+    fetcher_class = fetch.EthnologueCountryCodesFetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.EthnologueCountryCodesFetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         reader = csv.DictReader(StringIO(content), dialect="excel-tab")
-        rows_updated = rows_created = 0
-        for row in reader:
-            defaults = dict(
-                name=row["Name"],
-                area=row["Area"]
-            )
-            record, created = cls.objects.get_or_create(
-                code=row["CountryID"],
-                defaults=defaults
-            )
-            if created:
-                rows_created += 1
-            else:
-                for key in defaults:
-                    setattr(record, key, defaults[key])
-                record.save()
-                rows_updated += 1
-        log(user=None, action="SOURCE_ETHNOLOGUE_COUNTRY_CODE_RELOADED", extra={
-            "rows_created": rows_created,
-            "rows-updated": rows_updated
-        })
-
-
-class EthnologueLanguageIndex(models.Model):
+        with phase("parse") as timed:
+            rows = [
+                dict(
+                    code=row["CountryID"],
+                    name=row["Name"],
+                    area=row["Area"]
+                )
+                for row in reader
+            ]
+            timed.rows = len(rows)
+        diff = sync_rows(cls, "code", rows)
+        log(user=None, action="SOURCE_ETHNOLOGUE_COUNTRY_CODE_RELOADED", extra=diff.counts())
+        return changes(country_codes=diff.keys())
+
+
+class EthnologueLanguageIndex(ImportSource, models.Model):
 
     TYPE_LANGUAGE = "L"
     TYPE_LANGUAGE_ALTERNATE = "LA"
@@ -316,32 +334,33 @@ class EthnologueLanguageIndex(models.Model):
         verbose_name = "Ethnologue Language Index"
         verbose_name_plural = "Ethnologue Language Index"
 
+    fetcher_class = fetch.EthnologueLanguageIndexFetcher
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.EthnologueLanguageIndexFetcher(session).fetch()
-        if not content:
-            return
+    def load(cls, content):
         reader = csv.DictReader(StringIO(content), dialect="excel-tab")
-        rows_updated = rows_created = 0
-        for row in reader:
-            record, created = cls.objects.get_or_create(
-                language_code=row["LangID"],
-                country_code=row["CountryID"],
-                name_type=row["NameType"],
-                name=row["Name"]
+        date_imported = timezone.now()
+        with phase("parse") as timed:
+            rows = OrderedDict(
+                ((row["LangID"], row["CountryID"], row["NameType"], row["Name"]), date_imported)
+                for row in reader
             )
-            if created:
-                rows_created += 1
-            else:
-                rows_updated += 1  # @@@ Should never be an update on this table
+            timed.rows = len(rows)
+        rows_deleted, rows_created = copy_replace(
+            cls,
+            ["language_code", "country_code", "name_type", "name", "date_imported"],
+            (key + (value,) for key, value in rows.items())
+        )
         log(user=None, action="SOURCE_ETHNOLOGUE_LANG_INDEX_RELOADED", extra={
             "rows_created": rows_created,
-            "rows-updated": rows_updated
+            "rows-updated": 0,
+            "rows_deleted": rows_deleted
         })
+        return changes()
 
 
 @python_2_unicode_compatible
-class IMBPeopleGroup(models.Model):
+class IMBPeopleGroup(ImportSource, models.Model):
     peid = models.BigIntegerField(primary_key=True, verbose_name="PEID")
     affinity_bloc = models.CharField(max_length=75)
     people_cluster = models.CharField(max_length=75)
@@ -390,75 +409,112 @@ class IMBPeopleGroup(models.Model):
         verbose_name = "IMB People Group"
         verbose_name_plural = "IMB People Groups"
 
+    fetcher_class = fetch.IMBPeopleFetcher
+
+    # field name, header label in the sheet and, for flags, whether "no" and
+    # blank are told apart
+    COLUMNS = [
+        ("peid", "PEID", None),
+        ("affinity_bloc", "Affinity Bloc", None),
+        ("people_cluster", "People Cluster", None),
+        ("continent", "Continent", None),
+        ("sub_continent", "Sub-Continent", None),
+        ("country", "Country", None),
+        ("country_of_origin", "Country of Origin", None),
+        ("people_group", "People Group", None),
+        ("global_status_evangelical_christianity", "Global Status of  Evangelical Christianity", None),
+        ("evangelical_engagement", "Evangelical Engagement", False),
+        ("population", "Population", None),
+        ("dispersed", "Dispersed (Yes/No)", True),
+        ("rol", "ROL", None),
+        ("language", "Language", None),
+        ("religion", "Religion", None),
+        ("written_scripture", "Written Scripture", False),
+        ("jesus_film", "Jesus Film", False),
+        ("radio_broadcast", "Radio Broadcast", False),
+        ("gospel_recording", "Gospel Recording", False),
+        ("audio_scripture", "Audio Scripture", False),
+        ("bible_stories", "Bible Stories", False),
+        ("resources", "Resources", None),
+        ("physical_exertion", "Physical Exertion", None),
+        ("freedom_index", "Freedom Index", None),
+        ("government_restrictions_index", "Government Restrictions Index", None),
+        ("social_hostilities_index", "Social Hostilities Index", None),
+        ("threat_level", "Threat Level", None),
+        ("prayer_threads", "Prayer Threads", True),
+        ("sbc_embracing_relationship", "SBC Embracing Relationship", True),
+        ("embracing_priority", "Embracing Priority", False),
+        ("rop1", "ROP1", None),
+        ("rop2", "ROP2", None),
+        ("rop3", "ROP3", None),
+        ("people_name", "People Name", None),
+        ("fips", "FIPS", None),
+        ("fips_of_origin", "FIPS of Origin", None),
+        ("latitude", "Latitude", None),
+        ("longitude", "Longitude", None),
+        ("peid_of_origin", "PEID of Origin", None),
+        ("imb_affinity_group", "IMB Affinity Group", None),
+    ]
+
     @classmethod
-    def reload(cls, session):
-        content = fetch.IMBPeopleFetcher(session).fetch()
-        if content is None or content == "":
-            return
-        book = xlrd.open_workbook(file_contents=content)
-        sheet = book.sheet_by_index(0)
-        key_cell = (4, 0)   # todo: replace this with code to "find" the PEID column properly
-        sh_field_names = [sheet.cell_value(key_cell[0], key_cell[1] + x) for x in range(0, 40)]
-        current_row_num = key_cell[0] + 1
-        rows_created = rows_updated = 0
-        while True:
-            row = {sh_field_names[x]: sheet.cell_value(current_row_num, x) for x in range(0, 40)}
-            if str(row["PEID"]) == "":
-                break
-            defaults = dict(
-                affinity_bloc=row["Affinity Bloc"],
-                people_cluster=row["People Cluster"],
-                continent=row["Continent"],
-                sub_continent=row["Sub-Continent"],
-                country=row["Country"],
-                country_of_origin=row["Country of Origin"],
-                people_group=row["People Group"],
-                global_status_evangelical_christianity=row["Global Status of  Evangelical Christianity"],
-                evangelical_engagement=str_to_bool(row["Evangelical Engagement"]),
-                population=row["Population"],
-                dispersed=str_to_bool(row["Dispersed (Yes/No)"], allow_null=True),
-                rol=row["ROL"],
-                language=row["Language"],
-                religion=row["Religion"],
-                written_scripture=str_to_bool(row["Written Scripture"]),
-                jesus_film=str_to_bool(row["Jesus Film"]),
-                radio_broadcast=str_to_bool(row["Radio Broadcast"]),
-                gospel_recording=str_to_bool(row["Gospel Recording"]),
-                audio_scripture=str_to_bool(row["Audio Scripture"]),
-                bible_stories=str_to_bool(row["Bible Stories"]),
-                resources=row["Resources"],
-                physical_exertion=row["Physical Exertion"],
-                freedom_index=row["Freedom Index"],
-                government_restrictions_index=row["Government Restrictions Index"],
-                social_hostilities_index=row["Social Hostilities Index"],
-                threat_level=row["Threat Level"],
-                prayer_threads=str_to_bool(row["Prayer Threads"], allow_null=True),
-                sbc_embracing_relationship=str_to_bool(row["SBC Embracing Relationship"], allow_null=True),
-                embracing_priority=str_to_bool(row["Embracing Priority"]),
-                rop1=row["ROP1"],
-                rop2=row["ROP2"],
-                rop3=row["ROP3"],
-                people_name=row["People Name"],
-                fips=row["FIPS"],
-                fips_of_origin=row["FIPS of Origin"],
-                latitude=row["Latitude"],
-                longitude=row["Longitude"],
-                peid_of_origin=row["PEID of Origin"],
-                imb_affinity_group=row["IMB Affinity Group"]
-            )
-            record, created = cls.objects.get_or_create(
-                peid=row["PEID"],
-                defaults=defaults
-            )
-            if created:
-                rows_created += 1
+    def find_header(cls, sheet, label="PEID", max_rows=50):
+        for rowx in range(min(sheet.nrows, max_rows)):
+            for colx, value in enumerate(sheet.row_values(rowx)):
+                if force_text(value).strip() == label:
+                    return rowx, colx
+        raise ValueError("No {0} header in the first {1} rows".format(label, max_rows))
+
+    @classmethod
+    def read_columns(cls, sheet):
+        """
+        Read the sheet one column at a time below the PEID header, stopping
+        at the first row without a PEID, converting each column as a whole.
+        """
+        header_row, peid_col = cls.find_header(sheet)
+        headers = [force_text(value).strip() for value in sheet.row_values(header_row)]
+        positions = {header: colx for colx, header in enumerate(headers) if header}
+        peids = sheet.col_values(peid_col, header_row + 1)
+        end = next((i for i, peid in enumerate(peids) if force_text(peid).strip() == ""), len(peids))
+        columns = OrderedDict()
+        for name, header, allow_null in cls.COLUMNS:
+            values = sheet.col_values(positions[header], header_row + 1, header_row + 1 + end)
+            if allow_null is None:
+                to_python = cls._meta.get_field(name).to_python
+                columns[name] = [to_python(value) for value in values]
             else:
-                for key in defaults:
-                    setattr(record, key, defaults[key])
-                record.save()
-                rows_updated += 1
-            current_row_num += 1
-        log(user=None, action="SOURCE_IMB_PEOPLE_GROUPS_LOADED", extra={
-            "rows_created": rows_created,
-            "rows-updated": rows_updated
+                columns[name] = [str_to_bool(value, allow_null=allow_null) for value in values]
+        return columns
+
+    @classmethod
+    def load(cls, content):
+        started = time.time()
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        with phase("parse") as timed:
+            book = xlrd.open_workbook(file_contents=content, on_demand=True)
+            try:
+                columns = cls.read_columns(book.sheet_by_index(0))
+            finally:
+                book.release_resources()
+            timed.rows = len(columns["peid"])
+        names = list(columns.keys())
+        rows = (dict(zip(names, values)) for values in zip(*columns.values()))
+        diff = sync_rows(cls, "peid", rows, delete=False)
+        extra = diff.counts()
+        del extra["rows_deleted"]
+        extra.update({
+            "seconds": round(time.time() - started, 3),
+            # how far the load raised the process's peak memory use
+            "rss_growth_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_rss
         })
+        log(user=None, action="SOURCE_IMB_PEOPLE_GROUPS_LOADED", extra=extra)
+        return changes()
+
+
+def import_sources():
+    return sorted(
+        [
+            obj for obj in globals().values()
+            if isinstance(obj, type) and issubclass(obj, ImportSource) and obj.fetcher_class is not None
+        ],
+        key=lambda source: source.__name__
+    )
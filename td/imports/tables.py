@@ -0,0 +1,22 @@
+import re
+
+import bs4
+
+try:
+    import lxml  # noqa
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+
+def table_rows(content, css_class, parser=None):
+    """
+    Yield the text of the `td` cells of each row of the tables with
+    `css_class` in `content`. Only those tables are parsed, with lxml when it
+    is installed, rather than building a tree for the whole page.
+    """
+    # while parsing, the class attribute is still one string of all the classes
+    strainer = bs4.SoupStrainer("table", class_=re.compile(r"(^|\s){0}(\s|$)".format(re.escape(css_class))))
+    soup = bs4.BeautifulSoup(content, parser or PARSER, parse_only=strainer)
+    for tr in soup.find_all("tr"):
+        yield [td.get_text() for td in tr.find_all("td")]
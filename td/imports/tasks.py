@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+import requests
+
+from celery import chord, task
+from pinax.eventlog.models import log
+
+from td.instrumentation import instrumented, phase
+from td.tasks import integrate_imports, update_countries_from_imports
+
+from .models import changes, import_sources
+
+
+# sources read by update_countries_from_imports and by integrate_imports
+COUNTRY_SOURCES = ["EthnologueCountryCode", "WikipediaISOCountry"]
+LANGUAGE_SOURCES = ["EthnologueLanguageCode", "SIL_ISO_639_3", "WikipediaISOLanguage"]
+
+# how long a run waits for both of its integration stages to finish
+JOIN_TIMEOUT = 60 * 60 * 24
+
+
+def _join_key(run_id):
+    return "imports:reload:{0}".format(run_id)
+
+
+def _joined(run_id, stage, results):
+    """
+    Record the change sets in the `results` of a finished integration
+    stage's reloads, count the stage and return True for the second one of
+    the run, the point from which the languages can be integrated.
+    """
+    stage_changes = changes()
+    for result in results:
+        for kind in stage_changes:
+            stage_changes[kind].update(result.get(kind, []))
+    cache.set("{0}:{1}".format(_join_key(run_id), stage), stage_changes, JOIN_TIMEOUT)
+    return cache.incr(_join_key(run_id)) == 2
+
+
+def _integrate(run_id, full):
+    if full:
+        integrate_imports.delay(partitions=getattr(settings, "INTEGRATION_PARTITIONS", 1))
+        return
+    run_changes = changes()
+    for stage in ["countries", "languages"]:
+        stage_changes = cache.get("{0}:{1}".format(_join_key(run_id), stage))
+        if stage_changes is None:
+            # expired or evicted, the stage's changes are left to the next full integration
+            log(user=None, action="SOURCE_RELOAD_CHANGES_MISSING", extra={"run_id": run_id, "stage": stage})
+            continue
+        for kind, values in stage_changes.items():
+            run_changes[kind].update(values)
+    integrate_imports.delay(**{kind: sorted(values) for kind, values in run_changes.items()})
+
+
+@task(bind=True, ignore_result=False, max_retries=3, default_retry_delay=60)
+def reload_source(self, name, force=False):
+    """
+    Download and load one import source. A failed download is retried on its
+    own; once the retries are used up, or if the content fails to load, the
+    stored records are left as they are and the rest of the run goes on with
+    them.
+    """
+    source = {source.__name__: source for source in import_sources()}[name]
+    with instrumented("reload_source:{0}".format(name)):
+        fetcher = source.fetcher_class(requests.Session(), force=force)
+        try:
+            with phase("fetch"):
+                content = fetcher.fetch()
+        except requests.RequestException as e:
+            if self.request.retries < self.max_retries:
+                raise self.retry(exc=e)
+            log(user=None, action=fetcher.error_action_label, extra={"status_code": None, "text": str(e)})
+            return {"source": name, "status": "failed"}
+        if fetcher.unchanged:
+            return {"source": name, "status": "unchanged"}
+        if not content:
+            return {"source": name, "status": "empty"}
+        try:
+            loaded = source.load(content)
+        except Exception as e:
+            log(user=None, action=fetcher.error_action_label, extra={"status_code": None, "text": str(e)})
+            return {"source": name, "status": "failed"}
+        fetcher.store()
+    result = {kind: sorted(values) for kind, values in loaded.items()}
+    result.update({"source": name, "status": "loaded"})
+    return result
+
+
+@task()
+def integrate_countries(results, run_id, full=False):
+    update_countries_from_imports()
+    if _joined(run_id, "countries", results):
+        _integrate(run_id, full)
+
+
+@task()
+def integrate_languages(results, run_id, full=False):
+    if _joined(run_id, "languages", results):
+        _integrate(run_id, full)
+
+
+def start_reload(force=False, full=False):
+    """
+    Queue a reload of every import source, one task per source. The country
+    sources are followed by the country integration and the language sources
+    by the language integration, which also waits for the countries and,
+    unless `full`, only covers the change sets of the reloads; the remaining
+    sources are reloaded on their own.
+
+    Returns the AsyncResults of the queued tasks and chords.
+    """
+    run_id = uuid.uuid4().hex
+    cache.set(_join_key(run_id), 0, JOIN_TIMEOUT)
+    names = [source.__name__ for source in import_sources()]
+    signatures = [
+        chord([reload_source.s(name, force) for name in COUNTRY_SOURCES], integrate_countries.s(run_id, full)),
+        chord([reload_source.s(name, force) for name in LANGUAGE_SOURCES], integrate_languages.s(run_id, full)),
+    ]
+    signatures.extend([
+        reload_source.s(name, force)
+        for name in names
+        if name not in COUNTRY_SOURCES + LANGUAGE_SOURCES
+    ])
+    return [signature.apply_async() for signature in signatures]
@@ -0,0 +1,70 @@
+import os
+
+from django.core import management
+from django.test import TestCase
+
+from mock import Mock, patch
+
+from ..fetch import (
+    EthnologueCountryCodesFetcher,
+    EthnologueLanguageCodesFetcher,
+    EthnologueLanguageIndexFetcher,
+    IMBPeopleFetcher,
+    ISO_639_3Fetcher,
+    WikipediaCountryFetcher,
+    WikipediaFetcher
+)
+from ..models import (
+    EthnologueCountryCode,
+    EthnologueLanguageCode,
+    SIL_ISO_639_3,
+    WikipediaISOCountry,
+    WikipediaISOLanguage,
+    IMBPeopleGroup
+)
+
+
+FIXTURES = {
+    EthnologueCountryCodesFetcher.url: "CountryCodes.tab",
+    EthnologueLanguageCodesFetcher.url: "LanguageCodes.tab",
+    EthnologueLanguageIndexFetcher.url: "LanguageIndex.tab",
+    IMBPeopleFetcher.url: "imb_people_groups.xls",
+    ISO_639_3Fetcher.url: "iso_639_3.tab",
+    WikipediaCountryFetcher.url: "wikipedia_country.html",
+    WikipediaFetcher.url: "wikipedia.html",
+}
+
+
+def fixture_response(url, **kwargs):
+    path = os.path.join(os.path.dirname(__file__), "data", FIXTURES[url])
+    return Mock(status_code=200, content=open(path, "rb").read(), headers={})
+
+
+class ReloadImportsCommandTests(TestCase):
+
+    def test_loads_every_source(self):
+        # the mock's own call count is not updated atomically by the download threads
+        urls = []
+        session = Mock()
+        session.get.side_effect = lambda url, **kwargs: urls.append(url) or fixture_response(url, **kwargs)
+        with patch("td.imports.management.commands.reload_imports.pooled_session", return_value=session):
+            management.call_command("reload_imports", stdout=open(os.devnull, "w"))
+        self.assertEquals(sorted(urls), sorted(FIXTURES))
+        self.assertEquals(WikipediaISOLanguage.objects.count(), 184)
+        self.assertEquals(WikipediaISOCountry.objects.count(), 249)
+        self.assertEquals(EthnologueCountryCode.objects.count(), 234)
+        self.assertEquals(EthnologueLanguageCode.objects.count(), 2)
+        self.assertEquals(SIL_ISO_639_3.objects.count(), 2)
+        self.assertEquals(IMBPeopleGroup.objects.count(), 42)
+
+    def test_from_snapshots(self):
+        with patch("td.imports.management.commands.reload_imports.pooled_session") as pooled_session:
+            management.call_command(
+                "reload_imports",
+                from_snapshots=os.path.join(os.path.dirname(__file__), "data"),
+                stdout=open(os.devnull, "w")
+            )
+        self.assertFalse(pooled_session.called)
+        self.assertEquals(WikipediaISOLanguage.objects.count(), 184)
+        self.assertEquals(EthnologueCountryCode.objects.count(), 234)
+        self.assertEquals(IMBPeopleGroup.objects.count(), 42)
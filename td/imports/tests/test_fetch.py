@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from pinax.eventlog.models import Log
+from mock import Mock
+
+from ..fetch import WikipediaFetcher
+from ..models import WikipediaISOLanguage
+
+
+class SnapshotFetcherTests(TestCase):
+
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.data = open(os.path.join(os.path.dirname(__file__), "data", "wikipedia.html")).read()
+        self.session = Mock()
+        self.session.get.return_value = Mock(
+            status_code=200,
+            content=self.data,
+            headers={"ETag": '"abc"', "Last-Modified": "Tue, 25 Aug 2015 00:00:00 GMT"}
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_first_fetch_is_unconditional_and_stored(self):
+        fetcher = WikipediaFetcher(self.session, snapshot_dir=self.snapshot_dir)
+        self.assertEquals(fetcher.fetch(), self.data)
+        self.session.get.assert_called_with(WikipediaFetcher.url, headers={})
+        fetcher.store()
+        self.assertEquals(open(os.path.join(self.snapshot_dir, "wikipedia.html")).read(), self.data)
+
+    def test_conditional_request_not_modified(self):
+        fetcher = WikipediaFetcher(self.session, snapshot_dir=self.snapshot_dir)
+        fetcher.fetch()
+        fetcher.store()
+        self.session.get.return_value = Mock(status_code=304, content="", headers={})
+        fetcher = WikipediaFetcher(self.session, snapshot_dir=self.snapshot_dir)
+        self.assertIsNone(fetcher.fetch())
+        self.assertTrue(fetcher.unchanged)
+        self.session.get.assert_called_with(WikipediaFetcher.url, headers={
+            "If-None-Match": '"abc"',
+            "If-Modified-Since": "Tue, 25 Aug 2015 00:00:00 GMT"
+        })
+
+    def test_identical_content_is_unchanged(self):
+        fetcher = WikipediaFetcher(self.session, snapshot_dir=self.snapshot_dir)
+        fetcher.fetch()
+        fetcher.store()
+        fetcher = WikipediaFetcher(self.session, snapshot_dir=self.snapshot_dir)
+        self.assertIsNone(fetcher.fetch())
+        self.assertTrue(fetcher.unchanged)
+        fetcher = WikipediaFetcher(self.session, snapshot_dir=self.snapshot_dir, force=True)
+        self.assertEquals(fetcher.fetch(), self.data)
+
+    def test_reload_skips_unchanged_source(self):
+        logs = Log.objects.filter(action="SOURCE_WIKIPEDIA_RELOADED").count()
+        with override_settings(IMPORTS_SNAPSHOT_DIR=self.snapshot_dir):
+            WikipediaISOLanguage.reload(self.session)
+            WikipediaISOLanguage.objects.all().delete()
+            WikipediaISOLanguage.reload(self.session)
+        self.assertEquals(WikipediaISOLanguage.objects.count(), 0)
+        self.assertEquals(Log.objects.filter(action="SOURCE_WIKIPEDIA_RELOADED").count(), logs + 1)
@@ -0,0 +1,197 @@
+import os
+
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from pinax.eventlog.models import Log
+from mock import patch
+import xlrd
+
+from ..loaders import CopyStream, bulk_update, row_hash, swap_rows, sync_rows
+from ..models import EthnologueCountryCode, EthnologueLanguageIndex, IMBPeopleGroup, WikipediaISOLanguage
+
+
+class SyncRowsTests(TestCase):
+
+    def setUp(self):
+        self.data = open(os.path.join(os.path.dirname(__file__), "data", "CountryCodes.tab")).read()
+
+    def reload(self, content):
+        with patch("requests.Session") as mock_requests:
+            mock_requests.get().status_code = 200
+            mock_requests.get().content = content
+            EthnologueCountryCode.reload(mock_requests)
+        return Log.objects.filter(action="SOURCE_ETHNOLOGUE_COUNTRY_CODE_RELOADED").latest("timestamp").extra
+
+    def test_only_changed_rows_are_written(self):
+        extra = self.reload(self.data)
+        self.assertEquals(extra, {"rows_created": 234, "rows-updated": 0, "rows_deleted": 0, "rows_unchanged": 0})
+        extra = self.reload(self.data)
+        self.assertEquals(extra, {"rows_created": 0, "rows-updated": 0, "rows_deleted": 0, "rows_unchanged": 234})
+        data = self.data.replace("\tAndorra\t", "\tPrincipality of Andorra\t").replace("ZW\tZimbabwe\tAfrica\r\n", "")
+        extra = self.reload(data)
+        self.assertEquals(extra, {"rows_created": 0, "rows-updated": 1, "rows_deleted": 1, "rows_unchanged": 232})
+        self.assertEquals(EthnologueCountryCode.objects.get(code="AD").name, "Principality of Andorra")
+        self.assertFalse(EthnologueCountryCode.objects.filter(code="ZW").exists())
+
+    def test_wikipedia_reload_unchanged(self):
+        data = open(os.path.join(os.path.dirname(__file__), "data", "wikipedia.html")).read()
+        with patch("requests.Session") as mock_requests:
+            mock_requests.get().status_code = 200
+            mock_requests.get().content = data
+            WikipediaISOLanguage.reload(mock_requests)
+            pks = set(WikipediaISOLanguage.objects.values_list("pk", flat=True))
+            WikipediaISOLanguage.reload(mock_requests)
+        self.assertEquals(set(WikipediaISOLanguage.objects.values_list("pk", flat=True)), pks)
+        extra = Log.objects.filter(action="SOURCE_WIKIPEDIA_RELOADED").latest("timestamp").extra
+        self.assertEquals(extra, {"rows_created": 0, "rows-updated": 0, "rows_deleted": 0, "rows_unchanged": 184})
+
+    def test_nothing_changed_writes_nothing(self):
+        self.reload(self.data)
+        rows = list(EthnologueCountryCode.objects.values("code", "name", "area"))
+        with self.assertNumQueries(1):
+            diff = sync_rows(EthnologueCountryCode, "code", rows)
+        self.assertEquals(len(diff), 0)
+
+    def test_repeated_key_keeps_last_values(self):
+        diff = sync_rows(EthnologueCountryCode, "code", [
+            dict(code="ZZ", name="First", area="Africa"),
+            dict(code="ZZ", name="Second", area="Africa"),
+        ])
+        self.assertEquals(len(diff.inserts), 1)
+        self.assertEquals(EthnologueCountryCode.objects.get(code="ZZ").name, "Second")
+
+    def test_hash_normalizes_decimals(self):
+        latitude = IMBPeopleGroup._meta.get_field("latitude")
+        self.assertEquals(row_hash([latitude], [12.5]), row_hash([latitude], [Decimal("12.500000")]))
+
+
+class BulkUpdateTests(TestCase):
+
+    def setUp(self):
+        IMBPeopleGroup.load(open(os.path.join(os.path.dirname(__file__), "data", "imb_people_groups.xls"), "rb").read())
+        self.pks = list(IMBPeopleGroup.objects.order_by("pk").values_list("pk", flat=True)[:25])
+
+    def test_one_update_per_batch(self):
+        updates = [
+            (pk, {"country": "Elsewhere", "latitude": Decimal("1.5"), "prayer_threads": True if i % 2 else None})
+            for i, pk in enumerate(self.pks)
+        ]
+        with patch("td.imports.loaders.CASE_BATCH_SIZE", 10), CaptureQueriesContext(connection) as queries:
+            bulk_update(IMBPeopleGroup, updates, ["country", "latitude", "prayer_threads"], batch_size=10)
+        statements = [q["sql"] for q in queries.captured_queries if "UPDATE " in q["sql"]]
+        self.assertEquals(len(statements), 3)
+        if connection.vendor == "postgresql":
+            self.assertFalse([sql for sql in statements if "CASE" in sql])
+        groups = IMBPeopleGroup.objects.filter(pk__in=self.pks)
+        self.assertEquals(set(groups.values_list("country", "latitude")), {("Elsewhere", Decimal("1.5"))})
+        self.assertEquals(groups.filter(prayer_threads=True).count(), 12)
+        self.assertEquals(groups.filter(prayer_threads__isnull=True).count(), 13)
+
+
+class SwapRowsTests(TestCase):
+
+    def setUp(self):
+        self.data = open(os.path.join(os.path.dirname(__file__), "data", "wikipedia.html")).read()
+        with patch("requests.Session") as mock_requests:
+            mock_requests.get().status_code = 200
+            mock_requests.get().content = self.data
+            WikipediaISOLanguage.reload(mock_requests)
+
+    def test_swap_keeps_pks_of_existing_records(self):
+        rows = list(WikipediaISOLanguage.objects.values(
+            "iso_639_1", "language_family", "language_name", "native_name",
+            "iso_639_2t", "iso_639_2b", "iso_639_3", "iso_639_9"
+        ))
+        pks = dict(WikipediaISOLanguage.objects.values_list("iso_639_1", "pk"))
+        rows[0]["language_name"] = "Renamed"
+        deleted = rows.pop()["iso_639_1"]
+        rows.append(dict(rows[1], iso_639_1="zz"))
+        diff = swap_rows(WikipediaISOLanguage, "iso_639_1", rows)
+        self.assertEquals(diff.counts(), {"rows_created": 1, "rows-updated": 1, "rows_deleted": 1, "rows_unchanged": 182})
+        self.assertEquals(WikipediaISOLanguage.objects.get(iso_639_1=rows[0]["iso_639_1"]).language_name, "Renamed")
+        self.assertFalse(WikipediaISOLanguage.objects.filter(iso_639_1=deleted).exists())
+        new = WikipediaISOLanguage.objects.get(iso_639_1="zz")
+        self.assertNotIn(new.pk, pks.values())
+        del pks[deleted]
+        self.assertEquals(dict(WikipediaISOLanguage.objects.exclude(pk=new.pk).values_list("iso_639_1", "pk")), pks)
+
+    def test_swap_keeps_index_names(self):
+        if connection.vendor != "postgresql":
+            return
+        cursor = connection.cursor()
+        query = "SELECT indexname FROM pg_indexes WHERE tablename = %s ORDER BY indexname"
+        cursor.execute(query, [WikipediaISOLanguage._meta.db_table])
+        indexes = cursor.fetchall()
+        swap_rows(WikipediaISOLanguage, "iso_639_1", [dict(iso_639_1="zz", language_name="Test")])
+        cursor.execute(query, [WikipediaISOLanguage._meta.db_table])
+        self.assertEquals(cursor.fetchall(), indexes)
+        self.assertEquals(WikipediaISOLanguage.objects.count(), 1)
+        WikipediaISOLanguage.objects.create(iso_639_1="zy", language_name="Sequence")
+
+
+class SwapRowsFailureTests(TransactionTestCase):
+
+    def test_failed_swap_leaves_no_tables_behind(self):
+        if connection.vendor != "postgresql":
+            return
+        rows = [dict(iso_639_1="zz", language_name="Test")]
+        swap_rows(WikipediaISOLanguage, "iso_639_1", rows)
+        rows[0]["language_name"] = "Renamed"
+        with patch("td.imports.loaders.CopyStream", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                swap_rows(WikipediaISOLanguage, "iso_639_1", rows)
+        self.assertEquals(WikipediaISOLanguage.objects.get(iso_639_1="zz").language_name, "Test")
+        swap_rows(WikipediaISOLanguage, "iso_639_1", rows)
+        self.assertEquals(WikipediaISOLanguage.objects.get(iso_639_1="zz").language_name, "Renamed")
+
+
+class CopyReplaceTests(TestCase):
+
+    def test_full_language_index_replaces_table(self):
+        data = open(os.path.join(os.path.dirname(__file__), "data", "LanguageIndex.tab")).read()
+        with patch("requests.Session") as mock_requests:
+            mock_requests.get().status_code = 200
+            mock_requests.get().content = data
+            EthnologueLanguageIndex.reload(mock_requests)
+            EthnologueLanguageIndex.reload(mock_requests)
+        self.assertEquals(EthnologueLanguageIndex.objects.count(), 57197)
+        extra = Log.objects.filter(action="SOURCE_ETHNOLOGUE_LANG_INDEX_RELOADED").latest("timestamp").extra
+        self.assertEquals(extra, {"rows_created": 57197, "rows-updated": 0, "rows_deleted": 57197})
+
+    def test_copy_stream_escapes_text_format(self):
+        stream = CopyStream([("a\tb", "c\\d", None), ("e\nf", "", "g")])
+        self.assertEquals(stream.read(4), "a\\tb")
+        self.assertEquals(stream.read(), "\tc\\\\d\t\\N\ne\\nf\t\tg\n")
+        self.assertEquals(stream.read(), "")
+
+
+class IMBPeopleGroupLoadTests(TestCase):
+
+    def setUp(self):
+        self.data = open(os.path.join(os.path.dirname(__file__), "data", "imb_people_groups.xls"), "rb").read()
+
+    def test_load_is_batched_and_measured(self):
+        IMBPeopleGroup.load(self.data)
+        group = IMBPeopleGroup.objects.get(peid=24493)
+        self.assertEquals(group.country, "Tajikistan")
+        IMBPeopleGroup.objects.update(country="Elsewhere")
+        with CaptureQueriesContext(connection) as queries:
+            IMBPeopleGroup.load(self.data)
+        if connection.vendor == "postgresql":
+            statements = [q["sql"] for q in queries.captured_queries if "UPDATE " in q["sql"]]
+            self.assertEquals(len(statements), 1)
+            self.assertNotIn("CASE", statements[0])
+        self.assertEquals(IMBPeopleGroup.objects.get(peid=24493).country, "Tajikistan")
+        extra = Log.objects.filter(action="SOURCE_IMB_PEOPLE_GROUPS_LOADED").latest("timestamp").extra
+        self.assertEquals(extra["rows-updated"], 42)
+        self.assertEquals(extra["rows_unchanged"], 0)
+        self.assertIn("seconds", extra)
+        self.assertGreaterEqual(extra["rss_growth_kb"], 0)
+
+    def test_header_is_found(self):
+        book = xlrd.open_workbook(file_contents=self.data, on_demand=True)
+        self.assertEquals(IMBPeopleGroup.find_header(book.sheet_by_index(0)), (4, 0))
@@ -0,0 +1,28 @@
+import os
+
+from django.test import TestCase
+
+import bs4
+
+from ..tables import PARSER, table_rows
+
+
+class TableRowsTests(TestCase):
+
+    def assertRowsMatchFullParse(self, filename, css_class):
+        content = open(os.path.join(os.path.dirname(__file__), "data", filename)).read()
+        soup = bs4.BeautifulSoup(content, "html.parser")
+        expected = [[td.text for td in tr.find_all("td")] for tr in soup.select("table.{0} tr".format(css_class))]
+        self.assertTrue(expected)
+        for parser in {"html.parser", PARSER}:
+            self.assertEquals(list(table_rows(content, css_class, parser=parser)), expected)
+
+    def test_wikipedia_languages(self):
+        self.assertRowsMatchFullParse("wikipedia.html", "wikitable")
+
+    def test_wikipedia_countries(self):
+        self.assertRowsMatchFullParse("wikipedia_country.html", "sortable")
+
+    def test_class_is_matched_as_a_word(self):
+        content = "<table class='notsortable'><tr><td>a</td></tr></table><table class='x sortable'><tr><td>b</td></tr></table>"
+        self.assertEquals(list(table_rows(content, "sortable")), [["b"]])
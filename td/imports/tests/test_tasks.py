@@ -0,0 +1,80 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from mock import Mock, patch
+from pinax.eventlog.models import Log
+
+import requests
+
+from ..models import EthnologueCountryCode
+from ..tasks import integrate_countries, integrate_languages, reload_source, start_reload
+from .test_commands import fixture_response
+
+
+class ReloadSourceTaskTests(TestCase):
+
+    def test_loads_source(self):
+        with patch("requests.Session") as Session:
+            Session().get.side_effect = fixture_response
+            result = reload_source("EthnologueCountryCode")
+        self.assertEquals(result["status"], "loaded")
+        self.assertEquals(len(result["country_codes"]), 234)
+        self.assertEquals(result["codes"], [])
+        self.assertEquals(EthnologueCountryCode.objects.count(), 234)
+
+    def test_failed_download_is_retried(self):
+        with patch("requests.Session") as Session:
+            Session().get.side_effect = requests.ConnectionError()
+            with patch.object(reload_source, "retry", side_effect=RuntimeError) as retry:
+                with self.assertRaises(RuntimeError):
+                    reload_source("EthnologueCountryCode")
+        self.assertTrue(retry.called)
+
+    def test_failed_load_is_reported(self):
+        with patch("requests.Session") as Session:
+            Session().get.side_effect = fixture_response
+            with patch.object(EthnologueCountryCode, "load", side_effect=ValueError("Bad row")):
+                result = reload_source("EthnologueCountryCode")
+        self.assertEquals(result, {"source": "EthnologueCountryCode", "status": "failed"})
+        log = Log.objects.filter(action="SOURCE_ETHNOLOGUE_COUNTRY_CODE_RELOAD_FAILED").latest("timestamp")
+        self.assertEquals(log.extra["text"], "Bad row")
+
+
+class StartReloadTests(TestCase):
+
+    def start(self):
+        with patch("td.imports.tasks.uuid.uuid4", return_value=Mock(hex="run")), \
+                patch("td.imports.tasks.chord") as chord, \
+                patch("td.imports.tasks.reload_source") as reload_source:
+            reload_source.s.side_effect = lambda name, force: Mock(source=name)
+            start_reload()
+        return chord, reload_source
+
+    def test_sources_are_grouped_by_integration(self):
+        chord, reload_source = self.start()
+        self.assertEquals([[sig.source for sig in call[0][0]] for call in chord.call_args_list], [
+            ["EthnologueCountryCode", "WikipediaISOCountry"],
+            ["EthnologueLanguageCode", "SIL_ISO_639_3", "WikipediaISOLanguage"],
+        ])
+        self.assertEquals(reload_source.s.call_count, 7)
+
+    def test_languages_are_integrated_after_both_stages(self):
+        self.start()
+        with patch("td.imports.tasks.integrate_imports") as integrate_imports, \
+                patch("td.imports.tasks.update_countries_from_imports") as update_countries:
+            integrate_languages([{"codes": ["aar"], "country_codes": []}, {"status": "unchanged"}], "run")
+            self.assertFalse(integrate_imports.delay.called)
+            integrate_countries([{"codes": [], "country_codes": ["ET"]}], "run")
+        self.assertTrue(update_countries.called)
+        integrate_imports.delay.assert_called_once_with(codes=["aar"], country_codes=["ET"])
+
+    def test_missing_stage_changes_are_skipped(self):
+        self.start()
+        with patch("td.imports.tasks.integrate_imports") as integrate_imports, \
+                patch("td.imports.tasks.update_countries_from_imports"):
+            integrate_languages([{"codes": ["aar"], "country_codes": []}], "run")
+            cache.delete("imports:reload:run:languages")
+            integrate_countries([{"codes": [], "country_codes": ["ET"]}], "run")
+        integrate_imports.delay.assert_called_once_with(codes=[], country_codes=["ET"])
+        log = Log.objects.filter(action="SOURCE_RELOAD_CHANGES_MISSING").latest("timestamp")
+        self.assertEquals(log.extra, {"run_id": "run", "stage": "languages"})
@@ -0,0 +1,189 @@
+import json
+import resource
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+from django.utils import timezone
+
+from pinax.eventlog.models import log
+
+
+_local = threading.local()
+
+
+def _count_query():
+    _local.queries = getattr(_local, "queries", 0) + 1
+
+
+def _queries():
+    return getattr(_local, "queries", 0)
+
+
+class CountingCursorMixin(object):
+    """
+    Counts the statements a cursor executes, without the SQL formatting and
+    logging of the debug cursor.
+    """
+
+    def execute(self, sql, params=None):
+        _count_query()
+        return super(CountingCursorMixin, self).execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        _count_query()
+        return super(CountingCursorMixin, self).executemany(sql, param_list)
+
+
+class CountingCursorWrapper(CountingCursorMixin, CursorWrapper):
+    pass
+
+
+class CountingCursorDebugWrapper(CountingCursorMixin, CursorDebugWrapper):
+    pass
+
+
+@contextmanager
+def counting_queries():
+    """
+    Count the queries run on the default connection's cursors created within
+    the block, whether or not their queries are logged.
+    """
+    db = connections[DEFAULT_DB_ALIAS]
+    factories = {
+        "make_cursor": lambda cursor: CountingCursorWrapper(cursor, db),
+        "make_debug_cursor": lambda cursor: CountingCursorDebugWrapper(cursor, db),
+    }
+    saved = {name: db.__dict__[name] for name in factories if name in db.__dict__}
+    db.__dict__.update(factories)
+    try:
+        yield
+    finally:
+        for name in factories:
+            if name in saved:
+                db.__dict__[name] = saved[name]
+            else:
+                del db.__dict__[name]
+
+
+class Instrument(object):
+    """
+    The phases of one instrumented run, each with its number of calls, time,
+    SQL queries and, where the phase reports them, rows.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = OrderedDict()
+        self.started = time.time()
+        self.queries = _queries()
+        self.discarded = False
+        self.in_phase = False
+        self.joined = 0
+
+    def record(self, name, seconds, queries=0, rows=None):
+        phase = self.phases.setdefault(name, {"calls": 0, "seconds": 0, "queries": 0, "rows": 0})
+        phase["calls"] += 1
+        phase["seconds"] += seconds
+        phase["queries"] += queries
+        phase["rows"] += rows or 0
+
+    def discard(self):
+        """
+        Leave this run out of the reports, e.g. when it turned out to have
+        nothing to do; ignored from a run joined to an outer one.
+        """
+        if not self.joined:
+            self.discarded = True
+
+    def summary(self):
+        phases = OrderedDict()
+        for name, phase in self.phases.items():
+            phases[name] = dict(
+                phase,
+                seconds=round(phase["seconds"], 3),
+                rows_per_second=round(phase["rows"] / phase["seconds"], 1) if phase["rows"] and phase["seconds"] else None
+            )
+        return OrderedDict([
+            ("run", self.name),
+            ("finished_at", timezone.now().isoformat()),
+            ("seconds", round(time.time() - self.started, 3)),
+            ("queries", _queries() - self.queries),
+            ("peak_rss_kb", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+            ("phases", phases),
+        ])
+
+
+def current():
+    return getattr(_local, "instrument", None)
+
+
+class _Phase(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+
+
+@contextmanager
+def phase(name, rows=None):
+    """
+    Time the block as phase `name` of the current instrumented run. Yields
+    an object whose `rows` can be set to the number of rows the phase
+    handled once it is known. Outside a run, or within another phase, the
+    block is just run.
+    """
+    record = _Phase(rows)
+    instrument = current()
+    if instrument is None or instrument.in_phase:
+        yield record
+        return
+    instrument.in_phase = True
+    started, queries = time.time(), _queries()
+    try:
+        yield record
+    finally:
+        instrument.in_phase = False
+    instrument.record(name, time.time() - started, _queries() - queries, record.rows)
+
+
+@contextmanager
+def instrumented(name):
+    """
+    Instrument the block as the run `name`. Once it completes, its summary
+    is logged as PERFORMANCE_SUMMARY and appended as a line of JSON to the
+    INSTRUMENTATION_SUMMARY_FILE if one is set. A run started within
+    another is part of the outer one.
+
+    Queries are counted by the cursors of the default connection, see
+    `counting_queries`, leaving its query log as it was.
+    """
+    instrument = current()
+    if instrument is not None:
+        instrument.joined += 1
+        try:
+            yield instrument
+        finally:
+            instrument.joined -= 1
+        return
+    instrument = _local.instrument = Instrument(name)
+    try:
+        with counting_queries():
+            yield instrument
+        summary = instrument.summary()
+    finally:
+        _local.instrument = None
+    if not instrument.discarded:
+        report(summary)
+
+
+def report(summary):
+    log(user=None, action="PERFORMANCE_SUMMARY", extra=summary)
+    path = getattr(settings, "INSTRUMENTATION_SUMMARY_FILE", None)
+    if path:
+        with open(path, "a") as fp:
+            fp.write(json.dumps(summary) + "\n")
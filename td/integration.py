@@ -0,0 +1,375 @@
+import zlib
+
+from collections import OrderedDict
+from itertools import groupby
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils.encoding import force_bytes
+
+from td.imports.loaders import batches, bulk_update
+from td.imports.models import (
+    EthnologueCountryCode,
+    EthnologueLanguageCode,
+    SIL_ISO_639_3,
+    WikipediaISOCountry,
+    WikipediaISOLanguage
+)
+
+from .instrumentation import phase
+from .models import (
+    AdditionalLanguage,
+    Country,
+    CountryEAV,
+    IntegrationCheckpoint,
+    Language,
+    LanguageEAV,
+    Region
+)
+
+
+LANGUAGES_QUERY = """
+select coalesce(nullif(x.part_1, ''), x.code) as code,
+       coalesce(nullif(nn1.native_name, ''), nullif(nn2.native_name, ''), x.ref_name) as name,
+       coalesce(cc.code, ''),
+       nullif(nn1.native_name, '') as nn1name,
+       nn1.id,
+       nullif(nn2.native_name, '') as nn2name,
+       nn2.id,
+       x.ref_name as xname,
+       x.id,
+       x.code as iso_639_3
+  from imports_sil_iso_639_3 x
+left join imports_ethnologuelanguagecode lc on x.code = lc.code
+left join imports_wikipediaisolanguage nn1 on x.part_1 = nn1.iso_639_1
+left join imports_wikipediaisolanguage nn2 on x.code = nn2.iso_639_3
+left join imports_ethnologuecountrycode cc on lc.country_code = cc.code
+ where (lc.status = %s or lc.status is NULL){0}
+ order by code;
+"""
+
+# change sets touching more codes than this are integrated in full, which is
+# then the cheaper way
+MAX_CHANGED_CODES = 500
+
+# languages a chunked integration commits at a time
+CHUNK_SIZE = 1000
+
+# the fields integration writes, as (plan key, attname the tracker reported
+# them by in provenance); a language's country is planned by its code so a
+# plan can refer to countries that are still to be created
+LANGUAGE_FIELDS = [("name", "name"), ("iso_639_3", "iso_639_3"), ("country", "country_id")]
+COUNTRY_FIELDS = [("name", "name"), ("region_id", "region_id"), ("alpha_3_code", "alpha_3_code")]
+
+
+def _in(column, values):
+    return "{0} in ({1})".format(column, ", ".join(["%s"] * len(values)))
+
+
+def partition_of(code, partitions):
+    """
+    The partition, out of `partitions`, the language with `code` is
+    integrated in by a partitioned integration.
+    """
+    return (zlib.crc32(force_bytes(code)) & 0xffffffff) % partitions
+
+
+def merged_language_rows(codes=None, country_codes=None, partition=None):
+    """
+    The languages of the import tables merged with the additional languages,
+    one tuple per row of LANGUAGES_QUERY, sorted by code.
+
+    Given a change set, only the rows for the languages that depend on it
+    are returned: those whose ISO 639-3 or 639-1 code is in `codes` or whose
+    Ethnologue country is in `country_codes`, and the additional languages
+    merged into any of them or into one of `codes`. Given a `partition`, an
+    (index, partitions) pair, only the rows of the languages in it are.
+    """
+    params = [EthnologueLanguageCode.STATUS_LIVING]
+    conditions = []
+    if codes:
+        conditions.extend([_in("x.code", codes), _in("x.part_1", codes)])
+        params.extend(list(codes) * 2)
+    if country_codes:
+        conditions.append(_in("lc.country_code", country_codes))
+        params.extend(country_codes)
+    incremental = codes is not None or country_codes is not None
+    if incremental and not conditions:
+        rows = []
+    else:
+        cursor = connection.cursor()
+        cursor.execute(LANGUAGES_QUERY.format(
+            " and ({0})".format(" or ".join(conditions)) if conditions else ""
+        ), params)
+        rows = cursor.fetchall()
+    targets = {r[0] for r in rows} | set(codes or [])
+    rows.extend([
+        (x.merge_code(), x.merge_name(), None, "", None, "", None, "!ADDL", x.id, x.three_letter)
+        for x in AdditionalLanguage.objects.all()
+        if not incremental or x.merge_code() in targets
+    ])
+    if partition is not None:
+        rows = [r for r in rows if r[0] is not None and partition_of(r[0], partition[1]) == partition[0]]
+    rows.sort()
+    return rows
+
+
+class Plan(object):
+    """
+    The writes that bring a table in line with the import tables: `creates`
+    maps new codes to their field values, `updates` maps the codes of changed
+    records to (pk, old values, new values) and `provenance` lists the
+    (code, attribute, value, source model, source pk) records for its EAV
+    table.
+    """
+
+    def __init__(self):
+        self.creates = {}
+        self.updates = {}
+        self.provenance = []
+
+    def __len__(self):
+        return len(self.creates) + len(self.updates)
+
+    def changed(self, field):
+        return sorted(
+            (code, old[field], new[field])
+            for code, (_, old, new) in self.updates.items()
+            if old[field] != new[field]
+        )
+
+
+class LanguagePlan(Plan):
+
+    def summary(self):
+        return OrderedDict([
+            ("created", sorted((code, values["name"]) for code, values in self.creates.items())),
+            ("renamed", self.changed("name")),
+            ("moved to another country", self.changed("country")),
+            ("ISO 639-3 changes", self.changed("iso_639_3")),
+        ])
+
+
+class CountryPlan(Plan):
+
+    def __init__(self, regions):
+        super(CountryPlan, self).__init__()
+        self.regions = regions
+
+    def summary(self):
+        return OrderedDict([
+            ("created", sorted((code, values["name"]) for code, values in self.creates.items())),
+            ("renamed", self.changed("name")),
+            ("moved to another region", [
+                (code, self.regions.get(old), self.regions.get(new))
+                for code, old, new in self.changed("region_id")
+            ]),
+            ("alpha-3 changes", self.changed("alpha_3_code")),
+        ])
+
+
+def _finish(plan, stored, saved):
+    for code, values in saved.items():
+        if code not in stored:
+            plan.creates[code] = values
+        elif values != stored[code][1]:
+            plan.updates[code] = (stored[code][0], stored[code][1], values)
+    return plan
+
+
+def _record(plan, fields, code, previous, current, source):
+    if source is None:
+        return
+    for key, attname in fields:
+        if current[key] != previous[key]:
+            plan.provenance.append((code, attname, current[key] or "", source[0], source[1]))
+
+
+def plan_languages(rows, full=True, countries=None):
+    """
+    Work out the `LanguagePlan` for `rows` against the stored languages; when
+    `rows` are only those of a change set, pass `full=False` to load just
+    the languages they touch. `countries` are the codes of the countries a
+    language can be linked to, by default those stored.
+
+    Each row is applied in memory the way it used to be saved one language
+    at a time: the name and ISO 639-3 code with the Wikipedia, SIL or
+    additional language record they came from as the source, then the
+    country with its Ethnologue country code as the source. Every field a
+    step changes is recorded as provenance of that step's source, which is
+    what `td.resources.receivers.handle_entity_save` wrote on each save.
+    """
+    stored = {
+        values[0]: (values[1], dict(zip([key for key, _ in LANGUAGE_FIELDS], values[2:])))
+        for values in _stored_languages({r[0] for r in rows if r[0] is not None}, full)
+    }
+    if countries is None:
+        countries = set(Country.objects.values_list("code", flat=True))
+    country_codes = dict(EthnologueCountryCode.objects.values_list("code", "pk"))
+    plan = LanguagePlan()
+    saved = {}
+    for r in rows:
+        if r[0] is None:
+            continue
+        if r[0] not in saved:
+            saved[r[0]] = dict(stored[r[0]][1]) if r[0] in stored else {"name": "", "iso_639_3": "", "country": None}
+        current = dict(saved[r[0]], name=r[1])
+        if r[9] != "":
+            current["iso_639_3"] = r[9]
+        _record(plan, LANGUAGE_FIELDS, r[0], saved[r[0]], current, _name_source(r))
+        saved[r[0]] = current
+        if r[2]:
+            current = dict(current, country=r[2] if r[2] in countries else None)
+            _record(plan, LANGUAGE_FIELDS, r[0], saved[r[0]], current, (EthnologueCountryCode, country_codes[r[2]]))
+            saved[r[0]] = current
+    return _finish(plan, stored, saved)
+
+
+def _by_code(queryset, codes):
+    size = max(1, connection.ops.bulk_batch_size(["code"], codes))
+    return [values for batch in batches(sorted(codes), size) for values in queryset.filter(code__in=batch)]
+
+
+def _stored_languages(codes, full):
+    queryset = Language.objects.values_list("code", "pk", "name", "iso_639_3", "country__code")
+    return queryset if full else _by_code(queryset, codes)
+
+
+def _name_source(r):
+    """
+    The (model, pk) of the record the name of merged row `r` came from, or
+    None when it matches none of them.
+    """
+    source = None
+    if r[1] == r[3]:
+        source = (WikipediaISOLanguage, r[4])
+    if r[1] == r[5]:
+        source = (WikipediaISOLanguage, r[6])
+    if r[1] == r[7]:
+        source = (SIL_ISO_639_3, r[8])
+    if r[7] == "!ADDL":
+        source = (AdditionalLanguage, r[8])
+    return source
+
+
+def plan_countries():
+    """
+    Work out the `CountryPlan` for the imported countries the way they used
+    to be saved one at a time: every Ethnologue country sets the name and
+    the region named by its area, with itself as the source, then every
+    Wikipedia country sets the alpha-3 code, and the name of a country it
+    creates, without provenance.
+    """
+    stored = {
+        values[0]: (values[1], dict(zip([key for key, _ in COUNTRY_FIELDS], values[2:])))
+        for values in Country.objects.values_list("code", "pk", *[key for key, _ in COUNTRY_FIELDS])
+    }
+    regions = {}
+    for pk, name in Region.objects.order_by("name", "pk").values_list("pk", "name"):
+        regions.setdefault(name, pk)
+    plan = CountryPlan({pk: name for name, pk in regions.items()})
+    saved = {}
+    for pk, code, name, area in EthnologueCountryCode.objects.values_list("pk", "code", "name", "area"):
+        previous = saved.get(code) or _stored_country(stored, code)
+        current = dict(previous, name=name, region_id=regions.get(area))
+        _record(plan, COUNTRY_FIELDS, code, previous, current, (EthnologueCountryCode, pk))
+        saved[code] = current
+    for code, name, alpha_3 in WikipediaISOCountry.objects.values_list("alpha_2", "english_short_name", "alpha_3"):
+        if code in saved or code in stored:
+            saved[code] = dict(saved.get(code) or stored[code][1], alpha_3_code=alpha_3)
+        else:
+            saved[code] = dict(_stored_country(stored, code), name=name, alpha_3_code=alpha_3)
+    return _finish(plan, stored, saved)
+
+
+def _stored_country(stored, code):
+    if code in stored:
+        return dict(stored[code][1])
+    return {"name": "", "region_id": None, "alpha_3_code": ""}
+
+
+def _write_provenance(eav_model, entity_model, provenance, value=lambda attname, value: value):
+    pks = dict(_by_code(entity_model.objects.values_list("code", "pk"), {p[0] for p in provenance}))
+    eav_model.objects.bulk_create([
+        eav_model(
+            entity_id=pks[code],
+            attribute=attname,
+            value=value(attname, v),
+            source_ct=ContentType.objects.get_for_model(source_model),
+            source_id=source_id
+        )
+        for code, attname, v, source_model, source_id in provenance
+    ])
+
+
+def apply_language_plan(plan):
+    """
+    Write `plan` with bulk statements in a single transaction. Languages are
+    not saved one by one, so no per-language signals are sent.
+    """
+    with transaction.atomic():
+        countries = dict(Country.objects.values_list("code", "pk"))
+        Language.objects.bulk_create([
+            Language(code=code, name=v["name"], iso_639_3=v["iso_639_3"], country_id=countries.get(v["country"]))
+            for code, v in plan.creates.items()
+        ])
+        bulk_update(
+            Language,
+            [(pk, {"name": v["name"], "iso_639_3": v["iso_639_3"], "country": countries.get(v["country"])})
+             for pk, _, v in plan.updates.values()],
+            ["name", "iso_639_3", "country"]
+        )
+        _write_provenance(
+            LanguageEAV,
+            Language,
+            plan.provenance,
+            lambda attname, v: countries.get(v) or "" if attname == "country_id" else v
+        )
+
+
+def apply_country_plan(plan):
+    """
+    Write `plan` with bulk statements in a single transaction, without
+    per-country signals.
+    """
+    with transaction.atomic():
+        Country.objects.bulk_create([Country(code=code, **values) for code, values in plan.creates.items()])
+        bulk_update(
+            Country,
+            [(pk, {"name": v["name"], "region": v["region_id"], "alpha_3_code": v["alpha_3_code"]})
+             for pk, _, v in plan.updates.values()],
+            ["name", "region", "alpha_3_code"]
+        )
+        _write_provenance(CountryEAV, Country, plan.provenance)
+
+
+def integrate_in_chunks(rows, name, chunk_size=CHUNK_SIZE, resume=False):
+    """
+    Integrate merged `rows`, sorted by code, `chunk_size` languages at a time.
+    Each chunk is committed in its own transaction together with the
+    checkpoint `name`, which records the last code integrated, so an
+    interrupted run can be picked up with `resume` from where it stopped;
+    without it any old checkpoint is discarded. The checkpoint is removed
+    once every chunk is in.
+
+    Returns the checkpoint, holding the counts of the whole run.
+    """
+    checkpoint = IntegrationCheckpoint.objects.filter(name=name).first()
+    if checkpoint is None:
+        checkpoint = IntegrationCheckpoint(name=name, last_code="")
+    elif not resume:
+        checkpoint.last_code, checkpoint.languages_created, checkpoint.languages_updated = "", 0, 0
+    pending = [r for r in rows if r[0] is not None and r[0] > checkpoint.last_code]
+    languages = [list(group) for _, group in groupby(pending, key=lambda r: r[0])]
+    for chunk in batches(languages, chunk_size):
+        with phase("plan"):
+            plan = plan_languages([r for language in chunk for r in language], full=False)
+        with phase("write", rows=len(plan)), transaction.atomic():
+            apply_language_plan(plan)
+            checkpoint.last_code = chunk[-1][0][0]
+            checkpoint.languages_created += len(plan.creates)
+            checkpoint.languages_updated += len(plan.updates)
+            checkpoint.save()
+    if checkpoint.pk:
+        checkpoint.delete()
+    return checkpoint
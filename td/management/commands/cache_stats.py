@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ...caching import DATASETS, STATS
+
+
+class Command(BaseCommand):
+    help = "print the hit, miss and rebuild counters of the cached datasets"
+
+    def handle(self, *args, **options):
+        for name, dataset in sorted(DATASETS.items()):
+            stats = dataset.stats()
+            self.stdout.write("{}: {}".format(name, ", ".join(
+                "{} {}".format(stats[counter], counter) for counter in STATS
+            )))
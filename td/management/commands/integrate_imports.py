@@ -0,0 +1,76 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pinax.eventlog.models import log
+
+from ...integration import (
+    apply_country_plan,
+    apply_language_plan,
+    merged_language_rows,
+    plan_countries,
+    plan_languages
+)
+from ...models import Country, Language
+from ...signals import countries_integrated, languages_integrated
+from ...tasks import integrate_imports, update_countries_from_imports
+
+
+class Command(BaseCommand):
+    help = "integrate the import tables into the countries and languages"
+    option_list = BaseCommand.option_list + (
+        make_option(
+            "--plan",
+            action="store_true",
+            dest="plan",
+            default=False,
+            help="Only print the changes integration would make, without writing them"
+        ),
+        make_option(
+            "--resume",
+            action="store_true",
+            dest="resume",
+            default=False,
+            help="Integrate the languages in chunks, carrying on from where an interrupted run stopped"
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options["resume"]:
+            update_countries_from_imports()
+            integrate_imports(resume=True)
+            return
+        with transaction.atomic():
+            country_plan = plan_countries()
+            countries = set(Country.objects.values_list("code", flat=True)) | set(country_plan.creates)
+            language_plan = plan_languages(merged_language_rows(), countries=countries)
+            self.report("Countries", country_plan, int(options["verbosity"]))
+            self.report("Languages", language_plan, int(options["verbosity"]))
+            if options["plan"]:
+                return
+            apply_country_plan(country_plan)
+            apply_language_plan(language_plan)
+        countries_integrated.send(sender=Country)
+        languages_integrated.send(sender=Language)
+        log(user=None, action="INTEGRATED_SOURCE_DATA", extra={
+            "full": True,
+            "countries_created": len(country_plan.creates),
+            "countries_updated": len(country_plan.updates),
+            "languages_created": len(language_plan.creates),
+            "languages_updated": len(language_plan.updates)
+        })
+
+    def report(self, title, plan, verbosity):
+        summary = plan.summary()
+        self.stdout.write("{}: {}".format(title, ", ".join(
+            "{} {}".format(len(changes), label) for label, changes in summary.items()
+        )))
+        if verbosity < 2:
+            return
+        for label, changes in summary.items():
+            for change in changes:
+                if len(change) == 2:
+                    self.stdout.write(u"  {:<26} {:<12} {}".format(label, *change))
+                else:
+                    self.stdout.write(u"  {:<26} {:<12} {} -> {}".format(label, *change))
@@ -0,0 +1,29 @@
+from django.db import connection
+
+from .signals import begin_deferred, end_deferred
+
+
+class DeferredSignalsMiddleware(object):
+    """
+    Coalesce the cache invalidations and provenance writes of the changes a
+    request makes to languages and countries, see
+    `td.signals.deferred_signals`. Each request starts a deferral of its own.
+    """
+
+    def process_request(self, request):
+        request.deferred_signals = begin_deferred(join=False)
+
+    def process_exception(self, request, exception):
+        # the exception only rolls back the request's changes with
+        # ATOMIC_REQUESTS, otherwise they were committed as they were made
+        self.end(request, committed=not connection.settings_dict.get("ATOMIC_REQUESTS"))
+
+    def process_response(self, request, response):
+        self.end(request)
+        return response
+
+    def end(self, request, committed=True):
+        if getattr(request, "deferred_signals", None) is not None:
+            deferred, started = request.deferred_signals
+            request.deferred_signals = None
+            end_deferred(deferred, started, committed=committed)
@@ -198,9 +198,20 @@ class Language(models.Model):
 
     @classmethod
     def names_data(cls):
+        directions = dict(cls.DIRECTION_CHOICES)
         return [
-            dict(pk=x.pk, lc=x.lc, ln=x.ln, cc=[x.cc], lr=x.lr, gw=x.gateway_flag, ld=x.get_direction_display())
-            for x in cls.objects.all().order_by("code")
+            dict(
+                pk=pk,
+                lc=code,
+                ln=name.encode("utf-8"),
+                cc=[(country_code or "").encode("utf-8")],
+                lr=(region or "").encode("utf-8"),
+                gw=gateway_flag,
+                ld=directions.get(direction, direction)
+            )
+            for pk, code, name, country_code, region, gateway_flag, direction in cls.objects.order_by("code").values_list(
+                "pk", "code", "name", "country__code", "country__region__name", "gateway_flag", "direction"
+            )
         ]
 
 
@@ -226,4 +237,24 @@ class LanguageEAV(EAVBase):
     entity = models.ForeignKey(Language, related_name="attributes")
 
     class Meta:
-        db_table = 'uw_languageeav'
\ No newline at end of file
+        db_table = 'uw_languageeav'
+
+
+@python_2_unicode_compatible
+class IntegrationCheckpoint(models.Model):
+    """
+    The progress of a chunked integration: the code of the last language it
+    committed and the counts so far. Removed once the integration completes.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    last_code = models.CharField(max_length=100)
+    languages_created = models.IntegerField(default=0)
+    languages_updated = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def save(self, *args, **kwargs):
+        self.updated_at = timezone.now()
+        return super(IntegrationCheckpoint, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return "{0} at {1}".format(self.name, self.last_code)
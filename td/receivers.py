@@ -1,4 +1,3 @@
-from django.core.cache import cache
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.core.exceptions import ObjectDoesNotExist
@@ -11,17 +10,24 @@ from pinax.eventlog.models import log
 
 from .models import AdditionalLanguage
 from td.models import Country, Language
-from .signals import languages_integrated
+from td.resources.tasks import country_tree, map_gateways
+from .search import langnames
+from .signals import countries_integrated, languages_integrated, run_or_defer
+from .tasks import integrate_imports
 
 
 @receiver(post_save, sender=AdditionalLanguage)
-def handle_additionallanguage_save(sender, instance, **kwargs):
+def handle_additionallanguage_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
     a_code = instance.merge_code()
     lang, created = Language.objects.get_or_create(code=a_code)
     lang.name = instance.merge_name()
     lang.direction = instance.direction
     lang.iso_639_3 = instance.three_letter
+    lang.source = instance
     lang.save()
+    integrate_imports(codes=[a_code])
 
 
 @receiver(post_delete, sender=AdditionalLanguage)
@@ -36,30 +42,43 @@ def handle_additionallanguage_delete(sender, instance, **kwargs):
 
 @receiver(post_save, sender=Language)
 def handle_language_save(sender, **kwargs):
-    cache.delete("langnames")
-    cache.set("map_gateway_refresh", True)
+    run_or_defer(langnames.invalidate)
+    run_or_defer(map_gateways.invalidate)
+    run_or_defer(country_tree.invalidate)
 
 
 @receiver(post_delete, sender=Language)
 def handle_language_delete(sender, **kwargs):
-    cache.delete("langnames")
-    cache.set("map_gateway_refresh", True)
+    run_or_defer(langnames.invalidate)
+    run_or_defer(map_gateways.invalidate)
+    run_or_defer(country_tree.invalidate)
 
 
 @receiver(post_save, sender=Country)
 def handle_country_save(sender, **kwargs):
-    cache.set("map_gateway_refresh", True)
+    run_or_defer(map_gateways.invalidate)
+    run_or_defer(country_tree.invalidate)
 
 
 @receiver(post_delete, sender=Country)
 def handle_country_delete(sender, **kwargs):
-    cache.set("map_gateway_refresh", True)
+    run_or_defer(map_gateways.invalidate)
+    run_or_defer(country_tree.invalidate)
+
+
+@receiver(countries_integrated)
+def handle_countries_integrated(sender, **kwargs):
+    map_gateways.invalidate()
+    country_tree.invalidate()
 
 
 @receiver(languages_integrated)
-def handle_languages_integrated(sender, **kwargs):
-    cache.delete("langnames")
-    cache.set("langnames", Language.names_data(), None)
+def handle_languages_integrated(sender, full=True, **kwargs):
+    langnames.invalidate()
+    map_gateways.invalidate()
+    country_tree.invalidate()
+    if full:
+        langnames.get()
 
 
 @receiver(user_logged_in)
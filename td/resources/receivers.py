@@ -2,13 +2,11 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
-from django.contrib.contenttypes.models import ContentType
-
-
 from .models import (
     Language
 )
 from td.models import Country, Language
+from td.signals import record_provenance
 
 ENTITIES = [
     Country,
@@ -25,10 +23,7 @@ def handle_entity_save(sender, instance, *args, **kwargs):
     """
     if sender in ENTITIES:
         if getattr(instance, "source", None) is not None:
-            for attribute in instance.tracker.changed().keys():
-                instance.attributes.create(
-                    attribute=attribute,
-                    value=getattr(instance, attribute) or "",
-                    source_ct=ContentType.objects.get_for_model(instance.source),
-                    source_id=instance.source.pk
-                )
+            record_provenance(instance, [
+                (attribute, getattr(instance, attribute) or "")
+                for attribute in instance.tracker.changed().keys()
+            ], instance.source)
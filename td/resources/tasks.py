@@ -1,11 +1,12 @@
 from django.conf import settings
-from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from celery import task
 import requests
 from pinax.eventlog.models import log
-from .models import Title, Media
+from .models import Title, Media, transform_country_data
+from td.caching import CachedDataset
 from td.models import Country, Language
+from td.signals import deferred_signals
 
 
 def _get_obs_api_data():
@@ -58,13 +59,14 @@ def update_obs_resources():
 
 
 def seed_languages_gateway_language():
-    for lang in Language.objects.filter(gateway_language=None, gateway_flag=False):
-        if lang.country and lang.country.gateway_language():
-            lang.gateway_language = lang.country.gateway_language()
-            lang.save()
+    with deferred_signals():
+        for lang in Language.objects.filter(gateway_language=None, gateway_flag=False):
+            if lang.country and lang.country.gateway_language():
+                lang.gateway_language = lang.country.gateway_language()
+                lang.save()
 
 
-def update_map_gateways():
+def _build_map_gateways():
     country_gateways = {
         country.alpha_3_code: {
             "fillKey": country.gateway_language().code if country.gateway_language() else "defaultFill",
@@ -75,20 +77,28 @@ def update_map_gateways():
         }
         for country in Country.objects.all()
     }
-    cache.set("map_gateways", country_gateways)
     log(user=None, action="UPDATE_MAP_GATEWAYS")
+    return country_gateways
+
+
+# the data of the gateway languages map and of the country tree
+map_gateways = CachedDataset("map_gateways", _build_map_gateways)
+country_tree = CachedDataset("country_tree", lambda: transform_country_data(Country.gateway_data()))
+
+
+def update_map_gateways():
+    map_gateways.invalidate()
+    map_gateways.get()
 
 
 def get_map_gateways():
-    mg = cache.get("map_gateways", None)
-    if not mg:
-        update_map_gateways()
-        mg = cache.get("map_gateways", {})
-    return mg
+    return map_gateways.get()[0]
+
+
+def get_country_tree():
+    return country_tree.get()[0]
 
 
 @task()
 def check_map_gateways():
-    if cache.get("map_gateways_refresh", True):
-        cache.set("map_gateways_refresh", False)
-        update_map_gateways()
+    map_gateways.get()
@@ -0,0 +1,25 @@
+from django.test import TestCase
+
+from td.models import Country, Language
+from td.tests.test_caching import CachedDatasetTestMixin
+
+from ..tasks import get_country_tree, get_map_gateways
+
+
+class MapGatewaysTestCase(CachedDatasetTestMixin, TestCase):
+
+    def setUp(self):
+        super(MapGatewaysTestCase, self).setUp()
+        self.country = Country.objects.create(code="zq", name="Zedland", alpha_3_code="ZQQ")
+        self.language = Language.objects.create(code="zqa", name="Zeda", country=self.country, gateway_flag=True)
+
+    def test_map_data_is_rebuilt_after_a_change(self):
+        self.assertEquals(get_map_gateways()["ZQQ"]["gateway_languages"], ["(zqa) Zeda"])
+        get_country_tree()
+        with self.assertNumQueries(0):
+            get_map_gateways()
+            get_country_tree()
+        self.language.name = "Zedish"
+        self.language.save()
+        self.assertEquals(get_map_gateways()["ZQQ"]["gateway_languages"], ["(zqa) Zedish"])
+        self.assertIn("Zedland", [country["name"] for country in get_country_tree()["children"]])
@@ -0,0 +1,157 @@
+import json
+import re
+import threading
+
+from bisect import bisect_left, bisect_right
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .caching import CachedDataset
+from .models import Language
+
+
+# the fields of the cached language rows
+NAMES_DATA_FIELDS = ("pk", "lc", "ln", "cc", "lr", "gw", "ld")
+
+# ranks of the autocomplete matches, best first
+EXACT_CODE, CODE_PREFIX, COUNTRY_CODE, NAME_PREFIX, SUBSTRING = range(5)
+
+WORD = re.compile(r"\w+", re.U)
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _lower(value):
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return value.lower()
+
+
+def _sorted(pairs):
+    pairs = sorted(pairs)
+    return [key for key, _ in pairs], [row for _, row in pairs]
+
+
+def _build_names():
+    data = Language.names_data()
+    return {
+        "rows": [tuple(x[field] for field in NAMES_DATA_FIELDS) for x in data],
+        "json": json.dumps(data, cls=DjangoJSONEncoder)
+    }
+
+
+# `Language.names_data`, compactly as rows and encoded as JSON
+langnames = CachedDataset("langnames", _build_names)
+
+
+def names_data(value):
+    """
+    The language list from a value of `langnames`.
+    """
+    return [dict(zip(NAMES_DATA_FIELDS, row)) for row in value["rows"]]
+
+
+def cached_names_data():
+    """
+    The cached language list and the generation it was built for.
+    """
+    value, generation = langnames.get()
+    return names_data(value), generation
+
+
+def cached_names_json():
+    """
+    The cached language list encoded as JSON and the generation it was
+    built for.
+    """
+    value, generation = langnames.get()
+    return value["json"], generation
+
+
+class LanguageIndex(object):
+    """
+    The language list indexed for the autocomplete: sorted arrays of the
+    lowercased language and country codes for prefix lookups, and the
+    sorted suffixes of the words of the codes, names and regions, which
+    narrow a substring search down to the languages that can match it.
+    """
+
+    def __init__(self, data, version=None):
+        self.data = data
+        self.version = version
+        self.codes = [_lower(x["lc"]) for x in data]
+        self.names = [_lower(x["ln"]) for x in data]
+        self.texts = [u"\0".join([self.codes[i], self.names[i], _lower(x["lr"])]) for i, x in enumerate(data)]
+        self.sorted_codes, self.code_rows = _sorted((code, i) for i, code in enumerate(self.codes))
+        self.sorted_country_codes, self.country_code_rows = _sorted(
+            (_lower(cc), i) for i, x in enumerate(data) for cc in x["cc"] if cc
+        )
+        word_rows = {}
+        for i, text in enumerate(self.texts):
+            for word in WORD.findall(text):
+                word_rows.setdefault(word, set()).add(i)
+        words = list(word_rows)
+        self.word_rows = [word_rows[word] for word in words]
+        self.suffixes, self.suffix_words = _sorted(
+            (word[start:], w) for w, word in enumerate(words) for start in range(len(word))
+        )
+
+    def _prefixed(self, keys, rows, prefix):
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix[:-1] + unichr(ord(prefix[-1]) + 1)) if prefix else len(keys)
+        return rows[start:end]
+
+    def _equal(self, keys, rows, key):
+        return rows[bisect_left(keys, key):bisect_right(keys, key)]
+
+    def _containing(self, term):
+        words = WORD.findall(term)
+        if words:
+            suffix_words = self._prefixed(self.suffixes, self.suffix_words, max(words, key=len))
+            candidates = set().union(*[self.word_rows[w] for w in set(suffix_words)])
+        else:
+            candidates = range(len(self.texts))
+        return [i for i in candidates if term in self.texts[i]]
+
+    def search(self, term):
+        """
+        Return the languages matching `term`, each once, best matches first:
+        up to 3 characters long it is matched against the start of the
+        language codes and against the country codes, from 3 characters on
+        anywhere in the codes, names and regions.
+        """
+        term = _lower(term)
+        ranks = {}
+        if len(term) <= 3:
+            for i in self._prefixed(self.sorted_codes, self.code_rows, term):
+                ranks[i] = EXACT_CODE if self.codes[i] == term else CODE_PREFIX
+            for i in self._equal(self.sorted_country_codes, self.country_code_rows, term):
+                ranks.setdefault(i, COUNTRY_CODE)
+        if len(term) >= 3:
+            for i in self._containing(term):
+                if self.codes[i] == term:
+                    rank = EXACT_CODE
+                elif self.names[i].startswith(term):
+                    rank = NAME_PREFIX
+                else:
+                    rank = SUBSTRING
+                ranks[i] = min(ranks.get(i, rank), rank)
+        return [self.data[i] for i in sorted(ranks, key=lambda i: (ranks[i], i))]
+
+
+def language_index():
+    """
+    The process's `LanguageIndex`, rebuilt when the cached language list has
+    a new generation.
+    """
+    global _index
+    index = _index
+    if index is None or index.version != langnames.generation():
+        with _index_lock:
+            if _index is index:
+                value, generation = langnames.get()
+                if index is None or index.version != generation:
+                    _index = LanguageIndex(names_data(value), generation)
+            index = _index
+    return index
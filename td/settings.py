@@ -105,6 +105,7 @@ TEMPLATE_CONTEXT_PROCESSORS = [
 
 MIDDLEWARE_CLASSES = [
     "reversion.middleware.RevisionMiddleware",
+    "td.middleware.DeferredSignalsMiddleware",
     "opbeat.contrib.django.middleware.OpbeatAPMMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -231,6 +232,23 @@ AUTHENTICATION_BACKENDS = [
 
 UWADMIN_OBS_API_URL = "https://api.unfoldingword.org/obs/txt/1/obs-catalog.json"
 
+# Directory where the import sources keep a snapshot of their last loaded
+# payload, used to make conditional requests on reload (None disables it)
+IMPORTS_SNAPSHOT_DIR = None
+
+# Number of Celery tasks a full integration of the languages is split into
+# when it is queued after a reload
+INTEGRATION_PARTITIONS = int(os.environ.get("INTEGRATION_PARTITIONS", 1))
+
+# File the performance summary of every reload and integration run is
+# appended to as a line of JSON (None disables it; they are logged anyway)
+INSTRUMENTATION_SUMMARY_FILE = os.environ.get("INSTRUMENTATION_SUMMARY_FILE")
+
+# Bytes of cached datasets (the language list, country tree, map data) each
+# process keeps in memory in front of Redis, least recently used first out
+# (0 disables it)
+CACHE_L1_MAX_BYTES = int(os.environ.get("CACHE_L1_MAX_BYTES", 64 * 1024 * 1024))
+
 # Celery / Redis Backend configuration
 BROKER_URL = "redis://localhost:6379/0"
 CELERY_IGNORE_RESULT = True   # for now, we don't have any tasks that require looking at the result
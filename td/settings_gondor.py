@@ -38,6 +38,7 @@ if "GONDOR_REDIS_URL" in os.environ:
 
 MEDIA_ROOT = os.path.join(os.environ["GONDOR_DATA_DIR"], "site_media", "media")
 STATIC_ROOT = os.path.join(os.environ["GONDOR_DATA_DIR"], "site_media", "static")
+IMPORTS_SNAPSHOT_DIR = os.path.join(os.environ["GONDOR_DATA_DIR"], "imports")
 
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = os.environ.get("EMAIL_HOST")
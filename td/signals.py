@@ -1,3 +1,169 @@
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.dispatch import Signal
 
+from .instrumentation import phase
+
 languages_integrated = Signal()
+countries_integrated = Signal()
+
+_local = threading.local()
+
+
+class ProvenanceBuffer(object):
+    """
+    EAV provenance records waiting to be written, grouped by EAV model so
+    each model's records go in with one `bulk_create`. The content types of
+    their sources are resolved when they are written, from the in-process
+    content type cache or with a single query for those not in it yet.
+    """
+
+    def __init__(self):
+        self.records = OrderedDict()
+
+    def __len__(self):
+        return sum(len(records) for records in self.records.values())
+
+    def add(self, entity, attribute, value, source):
+        self.records.setdefault(entity.attributes.model, []).append((entity, attribute, value, source))
+
+    def clear(self):
+        self.records.clear()
+
+    def flush(self):
+        """
+        Write the records and return the number of inserts it took.
+        """
+        content_types = ContentType.objects.get_for_models(*{
+            type(source) for records in self.records.values() for _, _, _, source in records
+        })
+        for model, records in self.records.items():
+            model.objects.bulk_create([
+                model(
+                    entity=entity,
+                    attribute=attribute,
+                    value=value,
+                    source_ct=content_types[type(source)],
+                    source_id=source.pk
+                )
+                for entity, attribute, value, source in records
+            ])
+        inserts = len(self.records)
+        self.clear()
+        return inserts
+
+
+class DeferredSignals(object):
+    """
+    The work the Language and Country receivers put off inside
+    `deferred_signals()`: `calls` are the cache invalidations, each kept once
+    however often it was requested, and `provenance` the buffered provenance
+    records. `events` counts everything deferred and `coalesced` how many of
+    those events did not need a write of their own.
+    """
+
+    def __init__(self):
+        self.calls = OrderedDict()
+        self.provenance = ProvenanceBuffer()
+        self.events = 0
+        self.writes = 0
+
+    @property
+    def coalesced(self):
+        return self.events - self.writes
+
+    def flush(self, provenance=True):
+        for func, args in self.calls:
+            func(*args)
+            self.writes += 1
+        self.calls.clear()
+        if provenance:
+            self.writes += self.provenance.flush()
+        self.provenance.clear()
+
+
+def deferring():
+    return getattr(_local, "deferred", None)
+
+
+def run_or_defer(func, *args):
+    """
+    Call `func(*args)` now, or once when the current `deferred_signals()`
+    block ends.
+    """
+    deferred = deferring()
+    if deferred is None:
+        return func(*args)
+    deferred.events += 1
+    deferred.calls[(func, args)] = True
+
+
+def record_provenance(entity, attributes, source):
+    """
+    Record that `source` set `attributes`, (name, value) pairs, of `entity`:
+    with a single insert now, or with the other records of the current
+    `deferred_signals()` block when it ends.
+    """
+    deferred = deferring()
+    buffer = ProvenanceBuffer() if deferred is None else deferred.provenance
+    for attribute, value in attributes:
+        buffer.add(entity, attribute, value, source)
+    if deferred is None:
+        buffer.flush()
+    else:
+        deferred.events += len(attributes)
+
+
+def begin_deferred(join=True):
+    """
+    Start deferring the receivers' work, joining the current deferral if
+    there is one and `join`; returns the `DeferredSignals` and whether it was
+    started here, which is what `end_deferred` takes.
+    """
+    deferred = deferring()
+    if join and deferred is not None:
+        return deferred, False
+    deferred = _local.deferred = DeferredSignals()
+    return deferred, True
+
+
+def end_deferred(deferred, started, committed=True):
+    """
+    Do the deferred work, leaving out the provenance unless the changes it
+    records were `committed`.
+    """
+    if not started:
+        return
+    # reset before flushing, so neither the flush nor its failure leaves the
+    # deferral in place for the thread's next request
+    if deferring() is deferred:
+        _local.deferred = None
+    with phase("signals", rows=deferred.events):
+        deferred.flush(provenance=committed)
+
+
+@contextmanager
+def deferred_signals():
+    """
+    Coalesce the receivers' work for bulk changes to languages and
+    countries: inside the block each cache invalidation is done once and the
+    provenance records are written with one insert per model when the block
+    ends. Provenance is dropped if the block raises inside a transaction,
+    which rolls its changes back. Nested blocks join the outermost one.
+
+    Yields the `DeferredSignals`, whose `coalesced` count is final once the
+    block has ended.
+    """
+    deferred, started = begin_deferred()
+    succeeded = False
+    try:
+        yield deferred
+        succeeded = True
+    finally:
+        # outside a transaction the changes were committed as they were made
+        end_deferred(deferred, started, committed=succeeded or not connection.in_atomic_block)
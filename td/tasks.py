@@ -1,87 +1,134 @@
 from __future__ import absolute_import
 
-from django.db import connection
+import time
 
-from celery import task
+from celery import chord, task
 from pinax.eventlog.models import log
 
-from td.imports.models import (
-    EthnologueLanguageCode,
-    EthnologueCountryCode,
-    SIL_ISO_639_3,
-    WikipediaISOLanguage,
-    WikipediaISOCountry,
-    IMBPeopleGroup
-)
+from td.imports.loaders import BATCH_SIZE, batches
+from td.imports.models import IMBPeopleGroup
 
 from td.resources.models import Title, Resource, Media
-from td.models import Region, Country, Language
+from td.models import Country, Language
+
+from .instrumentation import instrumented, phase
+from .integration import (
+    MAX_CHANGED_CODES,
+    apply_country_plan,
+    apply_language_plan,
+    integrate_in_chunks,
+    merged_language_rows,
+    plan_countries,
+    plan_languages
+)
+from .signals import countries_integrated, languages_integrated
+
+
+@task()
+def integrate_imports(codes=None, country_codes=None, dry_run=False, partitions=1, resume=False):
+    """
+    Bring the languages in line with the import tables and the additional
+    languages. Given a change set (`codes` and/or `country_codes`, see
+    `td.imports.models.changes`) only the languages depending on it are
+    recomputed; without one, or for a large one, all of them are, in
+    checkpointed chunks that `resume` picks up after an interrupted run.
+
+    With `dry_run` nothing is written and the summary of the plan is
+    returned instead. A full integration with more than one of
+    `partitions` is queued as a task per partition instead of run here.
+    """
+    full = codes is None and country_codes is None
+    if not full and not codes and not country_codes:
+        return
+    if len(codes or []) + len(country_codes or []) > MAX_CHANGED_CODES:
+        full, codes, country_codes = True, None, None
+    if full and partitions > 1 and not dry_run:
+        chord(
+            [integrate_partition.s(index, partitions, resume) for index in range(partitions)],
+            finish_partitioned_integration.s()
+        ).apply_async()
+        return
+    if dry_run:
+        return plan_languages(merged_language_rows(codes, country_codes), full=full).summary()
+    with instrumented("integrate_imports") as instrument:
+        with phase("plan") as timed:
+            rows = merged_language_rows(codes, country_codes)
+            timed.rows = len(rows)
+        if full:
+            checkpoint = integrate_in_chunks(rows, "languages", resume=resume)
+            created, updated = checkpoint.languages_created, checkpoint.languages_updated
+        else:
+            with phase("plan"):
+                plan = plan_languages(rows, full=False)
+            if not plan:
+                instrument.discard()
+                return
+            with phase("write", rows=len(plan)):
+                apply_language_plan(plan)
+            created, updated = len(plan.creates), len(plan.updates)
+        with phase("signals"):
+            languages_integrated.send(sender=Language, full=full)
+        log(user=None, action="INTEGRATED_SOURCE_DATA", extra={
+            "full": full,
+            "languages_created": created,
+            "languages_updated": updated
+        })
 
-from .models import AdditionalLanguage
-from .signals import languages_integrated
+
+@task(ignore_result=False)
+def integrate_partition(index, partitions, resume=False):
+    """
+    Integrate the languages in one of the `partitions` of a full
+    integration (see `td.integration.partition_of`).
+    """
+    start = time.time()
+    with instrumented("integrate_partition:{0}/{1}".format(index, partitions)):
+        checkpoint = integrate_in_chunks(
+            merged_language_rows(partition=(index, partitions)),
+            "languages:{0}/{1}".format(index, partitions),
+            resume=resume
+        )
+    result = {
+        "partition": index,
+        "languages_created": checkpoint.languages_created,
+        "languages_updated": checkpoint.languages_updated,
+        "seconds": round(time.time() - start, 3)
+    }
+    log(user=None, action="INTEGRATED_SOURCE_DATA_PARTITION", extra=dict(result, partitions=partitions))
+    return result
 
 
 @task()
-def integrate_imports():
-    cursor = connection.cursor()
-    cursor.execute("""
-select coalesce(nullif(x.part_1, ''), x.code) as code,
-       coalesce(nullif(nn1.native_name, ''), nullif(nn2.native_name, ''), x.ref_name) as name,
-       coalesce(cc.code, ''),
-       nullif(nn1.native_name, '') as nn1name,
-       nn1.id,
-       nullif(nn2.native_name, '') as nn2name,
-       nn2.id,
-       x.ref_name as xname,
-       x.id,
-       x.code as iso_639_3
-  from imports_sil_iso_639_3 x
-left join imports_ethnologuelanguagecode lc on x.code = lc.code
-left join imports_wikipediaisolanguage nn1 on x.part_1 = nn1.iso_639_1
-left join imports_wikipediaisolanguage nn2 on x.code = nn2.iso_639_3
-left join imports_ethnologuecountrycode cc on lc.country_code = cc.code
- where lc.status = %s or lc.status is NULL order by code;
-""", [EthnologueLanguageCode.STATUS_LIVING])
-    rows = cursor.fetchall()
-    rows.extend([(x.merge_code(), x.merge_name(), None, "", None, "", None, "!ADDL", x.id, x.three_letter) for x in AdditionalLanguage.objects.all()])
-    rows.sort()
-    for r in rows:
-        if r[0] is not None:
-            language, _ = Language.objects.get_or_create(code=r[0])
-            language.name = r[1]
-            if r[1] == r[3]:
-                language.source = WikipediaISOLanguage.objects.get(pk=r[4])
-            if r[1] == r[5]:
-                language.source = WikipediaISOLanguage.objects.get(pk=r[6])
-            if r[1] == r[7]:
-                language.source = SIL_ISO_639_3.objects.get(pk=r[8])
-            if r[7] == "!ADDL":
-                language.source = AdditionalLanguage.objects.get(pk=r[8])
-            if r[9] != "":
-                language.iso_639_3 = r[9]
-            language.save()
-            if r[2]:
-                language.country = next(iter(Country.objects.filter(code=r[2])), None)
-                language.source = EthnologueCountryCode.objects.get(code=r[2])
-                language.save()
-    languages_integrated.send(sender=Language)
-    log(user=None, action="INTEGRATED_SOURCE_DATA", extra={})
+def finish_partitioned_integration(results):
+    results = sorted(results, key=lambda result: result["partition"])
+    languages_integrated.send(sender=Language, full=True)
+    log(user=None, action="INTEGRATED_SOURCE_DATA", extra={
+        "full": True,
+        "partitions": len(results),
+        "languages_created": sum(result["languages_created"] for result in results),
+        "languages_updated": sum(result["languages_updated"] for result in results),
+        "partition_seconds": [result["seconds"] for result in results]
+    })
 
 
 @task()
-def update_countries_from_imports():
-    for ecountry in EthnologueCountryCode.objects.all():
-        country, _ = Country.objects.get_or_create(code=ecountry.code)
-        country.region = next(iter(Region.objects.filter(name=ecountry.area)), None)
-        country.name = ecountry.name
-        country.source = ecountry
-        country.save()
-    for wcountry in WikipediaISOCountry.objects.all():
-        country, created_flag = Country.objects.get_or_create(code=wcountry.alpha_2)
-        if created_flag:
-            country.name = wcountry.english_short_name
-        country.alpha_3_code = wcountry.alpha_3
-        country.save()
+def update_countries_from_imports(dry_run=False):
+    """
+    Bring the countries in line with the Ethnologue and Wikipedia country
+    tables with a fixed number of queries, however many countries there are.
+    """
+    if dry_run:
+        return plan_countries().summary()
+    with instrumented("update_countries_from_imports") as instrument:
+        with phase("plan"):
+            plan = plan_countries()
+        if not plan:
+            instrument.discard()
+            return
+        with phase("write", rows=len(plan)):
+            apply_country_plan(plan)
+        with phase("signals"):
+            countries_integrated.send(sender=Country)
 
 
 def _get_or_create_object(model, slug, name):
@@ -92,25 +139,68 @@ def _get_or_create_object(model, slug, name):
     return o
 
 
+IMB_RESOURCES = {
+    "bible_stories": ("onestory-bible-stories", "OneStory Bible Storires", "audio", "Audio"),
+    "jesus_film": ("jesus-film", "The Jesus Film", "video", "Video"),
+    "gospel_recording": ("gospel-recording-grn", "Gospel Recording (GRN)", "audio", "Audio"),
+    "radio_broadcast": ("radio-broadcast-twr-febc", "Radio Broadcast (TWR/FEBC)", "audio", "Audio"),
+    "written_scripture": ("bible-portions", "Bible (Portions)", "print", "Print")
+}
+
+
+def _imb_languages(rols):
+    """
+    Map each ROL code to the pk of the language with that ISO 639-3 code,
+    or failing that with that code.
+    """
+    by_iso, by_code = {}, {}
+    for pk, code, iso_639_3 in Language.objects.order_by("pk").values_list("pk", "code", "iso_639_3"):
+        by_iso.setdefault(iso_639_3, pk)
+        by_code[code] = pk
+    return {rol: by_iso.get(rol) or by_code.get(rol) for rol in rols if by_iso.get(rol) or by_code.get(rol)}
+
+
 @task()
 def integrate_imb_language_data():
-    imb_map = {
-        "bible_stories": ("onestory-bible-stories", "OneStory Bible Storires", "audio", "Audio"),
-        "jesus_film": ("jesus-film", "The Jesus Film", "video", "Video"),
-        "gospel_recording": ("gospel-recording-grn", "Gospel Recording (GRN)", "audio", "Audio"),
-        "radio_broadcast": ("radio-broadcast-twr-febc", "Radio Broadcast (TWR/FEBC)", "audio", "Audio"),
-        "written_scripture": ("bible-portions", "Bible (Portions)", "print", "Print")
-    }
-    for imb in IMBPeopleGroup.objects.order_by("language").distinct("language"):
-        language = next(iter(Language.objects.filter(iso_639_3=imb.rol)), None)
-        if not language:
-            language = next(iter(Language.objects.filter(code=imb.rol)), None)
-        if language:
-            for k in imb_map.keys():
-                if getattr(imb, k):
-                    title = _get_or_create_object(Title, imb_map[k][0], imb_map[k][1])
-                    media = _get_or_create_object(Media, imb_map[k][2], imb_map[k][3])
-                    resource, _ = Resource.objects.get_or_create(language=language, title=title)
-                    resource.published_flag = True
-                    resource.save()
-                    resource.medias.add(media)
+    """
+    Publish a resource in every language of an IMB people group for each of
+    the IMB_RESOURCES the group has, with a fixed number of queries however
+    many people groups there are.
+    """
+    with instrumented("integrate_imb_language_data") as instrument:
+        with phase("plan"):
+            flags = list(IMB_RESOURCES)
+            groups = IMBPeopleGroup.objects.order_by("language").distinct("language").values_list("rol", *flags)
+            languages = _imb_languages({group[0] for group in groups})
+            titles = {k: _get_or_create_object(Title, v[0], v[1]) for k, v in IMB_RESOURCES.items()}
+            medias = {k: _get_or_create_object(Media, v[2], v[3]) for k, v in IMB_RESOURCES.items()}
+            wanted = {}
+            for group in groups:
+                if group[0] in languages:
+                    for k, flag in zip(flags, group[1:]):
+                        if flag:
+                            wanted.setdefault((languages[group[0]], titles[k].pk), set()).add(medias[k].pk)
+        if not wanted:
+            instrument.discard()
+            return
+        with phase("write", rows=len(wanted)):
+            title_pks = {title.pk for title in titles.values()}
+            resources = Resource.objects.filter(title__in=title_pks)
+            stored = {(r[1], r[2]): (r[0], r[3]) for r in resources.values_list("pk", "language", "title", "published_flag")}
+            Resource.objects.bulk_create([
+                Resource(language_id=language, title_id=title, published_flag=True)
+                for language, title in wanted
+                if (language, title) not in stored
+            ])
+            unpublished = [stored[key][0] for key in wanted if key in stored and not stored[key][1]]
+            for batch in batches(unpublished, BATCH_SIZE):
+                Resource.objects.filter(pk__in=batch).update(published_flag=True)
+            pks = {(r[1], r[2]): r[0] for r in resources.values_list("pk", "language", "title")}
+            through = Resource.medias.through
+            linked = set(through.objects.filter(resource__title__in=title_pks).values_list("resource", "media"))
+            through.objects.bulk_create([
+                through(resource_id=pks[key], media_id=media)
+                for key, media_pks in wanted.items()
+                for media in media_pks
+                if (pks[key], media) not in linked
+            ])
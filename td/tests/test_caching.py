@@ -0,0 +1,114 @@
+import threading
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from mock import Mock, patch
+
+from ..caching import CachedDataset, LocalCache
+
+
+class CachedDatasetTestMixin(object):
+    """
+    Runs each test with an empty cache, `self.cache`, patched into the
+    `cache_modules`, and an empty process cache, `self.local`.
+    """
+    cache_modules = ["td.caching"]
+
+    def setUp(self):
+        super(CachedDatasetTestMixin, self).setUp()
+        self.cache = LocMemCache(type(self).__name__, {})
+        self.cache.clear()
+        self.local = LocalCache()
+        patchers = [patch("{0}.cache".format(module), self.cache) for module in self.cache_modules]
+        patchers.append(patch("td.caching.local", self.local))
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class CachedDatasetTests(CachedDatasetTestMixin, TestCase):
+
+    def setUp(self):
+        super(CachedDatasetTests, self).setUp()
+        self.build = Mock(side_effect=["first", "second", "third"])
+        self.dataset = CachedDataset("test-dataset", self.build)
+
+    def test_value_is_built_once_per_generation(self):
+        value, generation = self.dataset.get()
+        self.assertEquals(value, "first")
+        self.assertEquals(self.dataset.get(), ("first", generation))
+        self.dataset.invalidate()
+        self.dataset.invalidate()
+        self.assertEquals(self.dataset.get(), ("second", generation + 2))
+        self.assertEquals(self.build.call_count, 2)
+
+    def test_previous_value_is_served_during_a_rebuild(self):
+        value, generation = self.dataset.get()
+        self.dataset.invalidate()
+        # another worker holds the lock of the new generation
+        self.assertTrue(self.dataset.acquire(generation + 1))
+        self.assertEquals(self.dataset.get(), ("first", generation))
+        self.assertEquals(self.build.call_count, 1)
+
+    def test_expired_lock_is_taken_over(self):
+        generation = self.dataset.generation()
+        self.cache.set(self.dataset.key("lock", generation), 0)
+        self.assertEquals(self.dataset.get(), ("first", generation))
+
+    def test_waits_for_a_rebuild_with_nothing_to_serve(self):
+        generation = self.dataset.generation()
+        self.assertTrue(self.dataset.acquire(generation))
+        timer = threading.Timer(0.1, self.cache.set, [self.dataset.key(generation), "built elsewhere"])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEquals(self.dataset.get(), ("built elsewhere", generation))
+        self.assertFalse(self.build.called)
+
+    def test_stats(self):
+        self.dataset.get()
+        self.dataset.get()
+        self.dataset.invalidate()
+        self.dataset.get()
+        stats = self.dataset.stats()
+        self.assertEquals(
+            {counter: stats[counter] for counter in ["local_hits", "hits", "misses", "stale", "rebuilds"]},
+            {"local_hits": 1, "hits": 0, "misses": 2, "stale": 0, "rebuilds": 2}
+        )
+        self.assertGreaterEqual(stats["rebuild_ms"], 0)
+
+    def test_value_is_served_from_memory_until_the_generation_changes(self):
+        value, generation = self.dataset.get()
+        self.cache.delete(self.dataset.key(generation))
+        self.assertEquals(self.dataset.get(), ("first", generation))
+        self.dataset.invalidate()
+        self.assertEquals(self.dataset.get(), ("second", generation + 1))
+        # another process rebuilt the value
+        self.cache.set(self.dataset.key(generation + 2), "elsewhere")
+        self.dataset.invalidate()
+        self.assertEquals(self.dataset.get(), ("elsewhere", generation + 2))
+        self.assertEquals(self.dataset.stats()["hits"], 1)
+
+
+class LocalCacheTests(TestCase):
+
+    @override_settings(CACHE_L1_MAX_BYTES=400)
+    def test_least_recently_used_are_evicted(self):
+        local = LocalCache()
+        local.set("a", 1, "a" * 150)
+        local.set("b", 1, "b" * 150)
+        local.get("a", 1)
+        local.set("c", 1, "c" * 150)
+        self.assertEquals([local.get(name, 1) for name in "abc"], ["a" * 150, None, "c" * 150])
+        local.set("d", 1, "d" * 500)
+        self.assertIsNone(local.get("d", 1))
+        local.set("a", 2, "A" * 150)
+        self.assertEquals([local.get("a", 1), local.get("a", 2)], [None, "A" * 150])
+        self.assertLessEqual(local.size, 400)
+
+    @override_settings(CACHE_L1_MAX_BYTES=0)
+    def test_disabled(self):
+        local = LocalCache()
+        local.set("a", 1, "a")
+        self.assertIsNone(local.get("a", 1))
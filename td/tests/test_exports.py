@@ -0,0 +1,67 @@
+import gzip
+import io
+import json
+import time
+
+from django.test import RequestFactory, TestCase
+
+from mock import patch
+
+from ..exports import _encode, export_artifact
+from ..models import Language
+from ..search import langnames
+from .test_caching import CachedDatasetTestMixin
+from ..views import codes_text_export, names_json_export, names_text_export
+
+
+class ExportTests(CachedDatasetTestMixin, TestCase):
+    cache_modules = ["td.caching", "td.exports"]
+
+    def setUp(self):
+        super(ExportTests, self).setUp()
+        Language.objects.create(code="zza", name="Zazaki")
+
+    def get(self, view, **headers):
+        return view(RequestFactory().get("/exports/", **headers))
+
+    def test_exports_match_the_languages(self):
+        self.assertEquals(self.get(codes_text_export).content, Language.codes_text())
+        self.assertEquals(self.get(names_text_export).content, Language.names_text())
+        response = self.get(names_json_export)
+        self.assertEquals(response["Content-Type"], "application/json")
+        self.assertEquals(json.loads(response.content), json.loads(json.dumps(Language.names_data())))
+
+    def test_compressed_variant(self):
+        response = self.get(names_text_export, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEquals(response["Content-Encoding"], "gzip")
+        self.assertEquals(response["Vary"], "Accept-Encoding")
+        self.assertEquals(gzip.GzipFile(fileobj=io.BytesIO(response.content)).read(), Language.names_text())
+        response = self.get(names_text_export, HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_repeat_polls_are_not_modified(self):
+        response = self.get(codes_text_export)
+        with self.assertNumQueries(0):
+            self.assertEquals(
+                self.get(codes_text_export, HTTP_IF_NONE_MATCH=response["ETag"]).status_code,
+                304
+            )
+            self.assertEquals(
+                self.get(codes_text_export, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code,
+                304
+            )
+            self.assertEquals(self.get(codes_text_export).status_code, 200)
+        Language.objects.create(code="zzb", name="Zazab")
+        response = self.get(codes_text_export, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEquals(response.status_code, 200)
+        self.assertIn("zzb", response.content.split())
+
+    def test_stale_generation_is_encoded_once(self):
+        version = export_artifact("langnames.txt")["version"]
+        langnames.invalidate()
+        # another worker is rebuilding the new generation
+        self.cache.add(langnames.key("lock", langnames.generation()), time.time() + 30, 30)
+        with patch("td.exports._encode", wraps=_encode) as encode:
+            for _ in range(2):
+                self.assertEquals(export_artifact("codes-d43.txt")["version"], version)
+        self.assertEquals(encode.call_count, 1)
@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+
+from collections import OrderedDict
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.backends.utils import CursorDebugWrapper
+from django.db.models import Max
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from pinax.eventlog.models import Log
+
+from td.imports.models import EthnologueCountryCode
+
+from ..instrumentation import instrumented, phase
+from ..models import Language
+from .test_integration import reload_fixture
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        self.logged = Log.objects.aggregate(pk=Max("pk"))["pk"] or 0
+
+    def summaries(self):
+        return [
+            entry.extra
+            for entry in Log.objects.filter(action="PERFORMANCE_SUMMARY", pk__gt=self.logged).order_by("pk")
+        ]
+
+    def test_phases_are_timed_and_counted(self):
+        queries_log = connection.queries_log
+        with instrumented("test") as instrument:
+            self.assertNotIsInstance(connection.cursor(), CursorDebugWrapper)
+            with phase("write", rows=2):
+                Language.objects.create(code="aa", name="Afar")
+                Language.objects.create(code="ab", name="Abkhaz")
+            with phase("write", rows=1):
+                Language.objects.create(code="ae", name="Avestan")
+            with phase("read") as timed:
+                timed.rows = len(Language.objects.filter(code__in=["aa", "ab", "ae"]))
+        self.assertIs(connection.queries_log, queries_log)
+        self.assertFalse(connection.queries_logged)
+        self.assertEquals(list(instrument.phases), ["write", "read"])
+        summary = self.summaries()[-1]
+        self.assertEquals(summary["run"], "test")
+        self.assertEquals(summary["queries"], 4)
+        self.assertEquals(
+            {key: summary["phases"]["write"][key] for key in ["calls", "queries", "rows"]},
+            {"calls": 2, "queries": 3, "rows": 3}
+        )
+        self.assertEquals(summary["phases"]["read"]["rows"], 3)
+        self.assertIn("rows_per_second", summary["phases"]["write"])
+        self.assertGreater(summary["peak_rss_kb"], 0)
+
+    def test_logged_queries_are_counted_and_kept(self):
+        with CaptureQueriesContext(connection) as queries:
+            with instrumented("test"):
+                Language.objects.create(code="aa", name="Afar")
+        self.assertEquals(self.summaries()[-1]["queries"], 1)
+        self.assertIn("uw_language", queries[0]["sql"])
+        self.assertNotIn("make_debug_cursor", vars(connections[DEFAULT_DB_ALIAS]))
+
+    def test_nested_runs_are_part_of_the_outer_one(self):
+        with instrumented("outer"):
+            with instrumented("inner") as inner:
+                with phase("write"):
+                    with phase("nested"):
+                        Language.objects.create(code="aa", name="Afar")
+                inner.discard()
+        summaries = self.summaries()
+        self.assertEquals([summary["run"] for summary in summaries], ["outer"])
+        self.assertEquals(list(summaries[0]["phases"]), ["write"])
+
+    def test_summary_file(self):
+        EthnologueCountryCode.objects.all().delete()
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with override_settings(INSTRUMENTATION_SUMMARY_FILE=path):
+            reload_fixture(EthnologueCountryCode, "CountryCodes.tab")
+            reload_fixture(EthnologueCountryCode, "CountryCodes.tab")
+        summaries = [json.loads(line, object_pairs_hook=OrderedDict) for line in open(path)]
+        self.assertEquals([summary["run"] for summary in summaries], ["reload:EthnologueCountryCode"] * 2)
+        self.assertEquals(list(summaries[0]["phases"]), ["fetch", "parse", "diff", "write"])
+        self.assertEquals(summaries[0]["phases"]["parse"]["rows"], 234)
+        self.assertNotIn("write", summaries[1]["phases"])
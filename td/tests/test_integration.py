@@ -0,0 +1,380 @@
+import os
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+
+from mock import patch
+
+from td.imports.models import (
+    IMBPeopleGroup,
+    EthnologueCountryCode,
+    EthnologueLanguageCode,
+    SIL_ISO_639_3,
+    WikipediaISOCountry,
+    WikipediaISOLanguage
+)
+
+from ..integration import (
+    apply_language_plan,
+    integrate_in_chunks,
+    merged_language_rows,
+    partition_of,
+    plan_countries,
+    plan_languages
+)
+from ..models import (
+    AdditionalLanguage,
+    Country,
+    CountryEAV,
+    IntegrationCheckpoint,
+    Language,
+    LanguageEAV,
+    Region
+)
+from pinax.eventlog.models import Log
+
+from td.resources.models import Resource, Title
+
+from ..tasks import (
+    finish_partitioned_integration,
+    integrate_imb_language_data,
+    integrate_imports,
+    integrate_partition,
+    update_countries_from_imports
+)
+
+
+def reload_fixture(model, filename):
+    with patch("requests.Session") as mock_requests:
+        mock_requests.get().status_code = 200
+        mock_requests.get().content = open(os.path.join(os.path.dirname(__file__), "../imports/tests/data", filename)).read()
+        model.reload(mock_requests)
+
+
+class IntegrateImportsTests(TestCase):
+
+    def setUp(self):
+        reload_fixture(WikipediaISOLanguage, "wikipedia.html")
+        reload_fixture(EthnologueLanguageCode, "LanguageCodes.tab")
+        reload_fixture(EthnologueCountryCode, "CountryCodes.tab")
+        reload_fixture(SIL_ISO_639_3, "iso_639_3.tab")
+        reload_fixture(WikipediaISOCountry, "wikipedia_country.html")
+        AdditionalLanguage.objects.create(ietf_tag="es-419", common_name="Spanish Latin America", native_name="Espanol")
+        update_countries_from_imports()
+
+    def test_languages_and_provenance(self):
+        integrate_imports()
+        aa = Language.objects.get(code="aa")
+        self.assertEquals(aa.name, "Afaraf")
+        self.assertEquals(aa.iso_639_3, "aar")
+        self.assertEquals(aa.country, Country.objects.get(code="ET"))
+        self.assertEquals(Language.objects.get(code="es-419").name, "Espanol")
+        self.assertEquals(
+            sorted(aa.attributes.values_list("attribute", "source_ct", "source_id")),
+            sorted([
+                ("country_id", ContentType.objects.get_for_model(EthnologueCountryCode).pk,
+                 EthnologueCountryCode.objects.get(code="ET").pk),
+                ("iso_639_3", ContentType.objects.get_for_model(WikipediaISOLanguage).pk,
+                 WikipediaISOLanguage.objects.get(iso_639_1="aa").pk),
+                ("name", ContentType.objects.get_for_model(WikipediaISOLanguage).pk,
+                 WikipediaISOLanguage.objects.get(iso_639_1="aa").pk),
+            ])
+        )
+
+    def test_rerun_writes_nothing(self):
+        integrate_imports()
+        self.assertEquals(len(plan_languages(merged_language_rows())), 0)
+        eav = LanguageEAV.objects.count()
+        integrate_imports()
+        self.assertEquals(LanguageEAV.objects.count(), eav)
+
+    def test_rename_is_updated_with_provenance(self):
+        integrate_imports()
+        WikipediaISOLanguage.objects.filter(iso_639_1="aa").update(native_name="Qafar af")
+        plan = plan_languages(merged_language_rows())
+        self.assertEquals(plan.updates, {
+            "aa": (
+                Language.objects.get(code="aa").pk,
+                {"name": "Afaraf", "iso_639_3": "aar", "country": "ET"},
+                {"name": "Qafar af", "iso_639_3": "aar", "country": "ET"}
+            )
+        })
+        integrate_imports()
+        self.assertEquals(Language.objects.get(code="aa").name, "Qafar af")
+        self.assertTrue(LanguageEAV.objects.filter(entity__code="aa", attribute="name", value="Qafar af").exists())
+
+    def test_bulk_statements(self):
+        with patch("td.tasks.languages_integrated"), CaptureQueriesContext(connection) as queries:
+            integrate_imports()
+        statements = [query["sql"] for query in queries.captured_queries]
+        self.assertEquals(len([sql for sql in statements if 'INSERT INTO "uw_language" ' in sql]), 1)
+        self.assertEquals(len([sql for sql in statements if 'INSERT INTO "uw_languageeav" ' in sql]), 1)
+        # a fixed number of queries, including the checkpoint of its one chunk
+        self.assertLessEqual(len(statements), 18)
+
+
+class IncrementalIntegrationTests(TestCase):
+
+    def setUp(self):
+        reload_fixture(WikipediaISOLanguage, "wikipedia.html")
+        reload_fixture(EthnologueLanguageCode, "LanguageCodes.tab")
+        reload_fixture(EthnologueCountryCode, "CountryCodes.tab")
+        reload_fixture(SIL_ISO_639_3, "iso_639_3.tab")
+        update_countries_from_imports()
+        integrate_imports()
+        WikipediaISOLanguage.objects.filter(iso_639_1="aa").update(native_name="Qafar af")
+
+    def test_only_languages_of_the_change_set_are_recomputed(self):
+        integrate_imports(codes=["kmg"])
+        self.assertEquals(Language.objects.get(code="aa").name, "Afaraf")
+        integrate_imports(codes=["aar"])
+        self.assertEquals(Language.objects.get(code="aa").name, "Qafar af")
+
+    def test_country_change_set(self):
+        EthnologueLanguageCode.objects.filter(code="aar").update(country_code="DJ")
+        integrate_imports(country_codes=["DJ"])
+        self.assertEquals(Language.objects.get(code="aa").country.code, "DJ")
+
+    def test_empty_change_set_writes_nothing(self):
+        with self.assertNumQueries(0):
+            integrate_imports(codes=[], country_codes=[])
+
+    def test_reload_returns_change_set(self):
+        content = open(os.path.join(os.path.dirname(__file__), "../imports/tests/data/LanguageCodes.tab")).read()
+        changes = EthnologueLanguageCode.load(content.replace("aar\tET", "aar\tDJ"))
+        self.assertEquals(changes, {"codes": {"aar"}, "country_codes": set()})
+
+    def test_additional_language_save_is_integrated(self):
+        additional = AdditionalLanguage.objects.create(ietf_tag="zz-x-test", two_letter="zz", common_name="Zed")
+        self.assertEquals(Language.objects.get(code="zz").name, "Zed")
+        self.assertEquals(Language.objects.get(code="aa").name, "Afaraf")
+        self.assertTrue(LanguageEAV.objects.filter(
+            entity__code="zz",
+            source_ct=ContentType.objects.get_for_model(AdditionalLanguage),
+            source_id=additional.pk
+        ).exists())
+
+    def test_additional_language_sets_its_codes(self):
+        Language.objects.create(code="zz", name="Zed", iso_639_3="zzz")
+        AdditionalLanguage.objects.create(ietf_tag="zz-x-test", two_letter="zz", common_name="Zeddish")
+        self.assertEquals(Language.objects.filter(code="zz").values_list("name", "iso_639_3").get(), ("Zeddish", ""))
+
+    def test_raw_additional_language_save_is_not_integrated(self):
+        with patch("td.receivers.integrate_imports") as integrate_imports:
+            AdditionalLanguage(ietf_tag="zz-x-test", two_letter="zz", common_name="Zed").save_base(raw=True)
+        self.assertFalse(integrate_imports.called)
+        self.assertFalse(Language.objects.filter(code="zz").exists())
+
+
+class IntegrationPlanTests(TestCase):
+
+    def setUp(self):
+        reload_fixture(WikipediaISOLanguage, "wikipedia.html")
+        reload_fixture(EthnologueLanguageCode, "LanguageCodes.tab")
+        reload_fixture(EthnologueCountryCode, "CountryCodes.tab")
+        reload_fixture(SIL_ISO_639_3, "iso_639_3.tab")
+        reload_fixture(WikipediaISOCountry, "wikipedia_country.html")
+
+    def test_plan_writes_nothing(self):
+        out = StringIO()
+        call_command("integrate_imports", plan=True, stdout=out)
+        self.assertFalse(Country.objects.exists())
+        self.assertFalse(Language.objects.exists())
+        self.assertIn("Countries: 249 created", out.getvalue())
+        self.assertIn("Languages: 2 created", out.getvalue())
+
+    def test_plan_summarizes_changes(self):
+        call_command("integrate_imports", stdout=StringIO())
+        WikipediaISOLanguage.objects.filter(iso_639_1="aa").update(native_name="Qafar af")
+        EthnologueLanguageCode.objects.filter(code="aar").update(country_code="DJ")
+        EthnologueCountryCode.objects.filter(code="AD").update(name="Principality of Andorra")
+        self.assertEquals(
+            integrate_imports(dry_run=True),
+            {
+                "created": [],
+                "renamed": [("aa", "Afaraf", "Qafar af")],
+                "moved to another country": [("aa", "ET", "DJ")],
+                "ISO 639-3 changes": []
+            }
+        )
+        self.assertEquals(update_countries_from_imports(dry_run=True)["renamed"], [
+            ("AD", "Andorra", "Principality of Andorra")
+        ])
+        self.assertEquals(Language.objects.get(code="aa").name, "Afaraf")
+
+    def test_apply_matches_per_row_integration(self):
+        update_countries_from_imports()
+        countries = sorted(Country.objects.values_list("code", "name", "region_id", "alpha_3_code"))
+        attributes = sorted(CountryEAV.objects.values_list("entity__code", "attribute", "value", "source_id"))
+        Country.objects.all().delete()
+        call_command("integrate_imports", stdout=StringIO())
+        self.assertEquals(sorted(Country.objects.values_list("code", "name", "region_id", "alpha_3_code")), countries)
+        self.assertEquals(
+            sorted(CountryEAV.objects.values_list("entity__code", "attribute", "value", "source_id")),
+            attributes
+        )
+        self.assertEquals(len(plan_countries()), 0)
+        self.assertEquals(Language.objects.get(code="aa").country.code, "ET")
+
+
+class CountryIntegrationTests(TestCase):
+
+    def setUp(self):
+        reload_fixture(EthnologueCountryCode, "CountryCodes.tab")
+        reload_fixture(WikipediaISOCountry, "wikipedia_country.html")
+        Region.objects.create(name="Europe", slug="europe")
+
+    def test_constant_queries(self):
+        with patch("td.tasks.countries_integrated") as countries_integrated, \
+                CaptureQueriesContext(connection) as queries:
+            update_countries_from_imports()
+        self.assertLessEqual(len(queries), 12)
+        countries_integrated.send.assert_called_once_with(sender=Country)
+        self.assertEquals(Country.objects.count(), 249)
+        andorra = Country.objects.get(code="AD")
+        self.assertEquals((andorra.name, andorra.region.name, andorra.alpha_3_code), ("Andorra", "Europe", "AND"))
+        self.assertEquals(
+            sorted(andorra.attributes.values_list("attribute", flat=True)),
+            ["name", "region_id"]
+        )
+        EthnologueCountryCode.objects.filter(code="AD").update(name="Principality of Andorra")
+        with self.assertNumQueries(4):
+            update_countries_from_imports(dry_run=True)
+        update_countries_from_imports()
+        self.assertEquals(Country.objects.get(code="AD").name, "Principality of Andorra")
+        with patch("td.tasks.countries_integrated") as countries_integrated:
+            update_countries_from_imports()
+        self.assertFalse(countries_integrated.send.called)
+
+
+class IMBIntegrationTests(TestCase):
+
+    def setUp(self):
+        IMBPeopleGroup.load(open(os.path.join(os.path.dirname(__file__), "../imports/tests/data/imb_people_groups.xls"), "rb").read())
+        Language.objects.create(code="ne", iso_639_3="npi", name="Nepali")
+        Language.objects.create(code="prs", name="Dari")
+
+    def resources(self):
+        return sorted(
+            (r.language.code, r.title.slug, r.published_flag, sorted(m.slug for m in r.medias.all()))
+            for r in Resource.objects.all()
+        )
+
+    def test_resources_are_published(self):
+        if connection.vendor != "postgresql":
+            return
+        title = Title.objects.create(slug="bible-portions", name="Bible (Portions)")
+        Resource.objects.create(language=Language.objects.get(code="ne"), title=title, published_flag=False)
+        integrate_imb_language_data()
+        expected = [
+            ("ne", "bible-portions", True, ["print"]),
+            ("ne", "jesus-film", True, ["video"]),
+            ("prs", "bible-portions", True, ["print"]),
+            ("prs", "gospel-recording-grn", True, ["audio"]),
+            ("prs", "jesus-film", True, ["video"]),
+        ]
+        self.assertEquals(self.resources(), expected)
+        integrate_imb_language_data()
+        self.assertEquals(self.resources(), expected)
+
+    def test_queries_do_not_grow_with_people_groups(self):
+        if connection.vendor != "postgresql":
+            return
+        integrate_imb_language_data()
+        Resource.objects.all().delete()
+        with CaptureQueriesContext(connection) as few:
+            integrate_imb_language_data()
+        Resource.objects.all().delete()
+        for rol in IMBPeopleGroup.objects.values_list("rol", flat=True).distinct():
+            Language.objects.get_or_create(code=rol)
+        with CaptureQueriesContext(connection) as many:
+            integrate_imb_language_data()
+        self.assertGreater(Resource.objects.count(), 5)
+        self.assertEquals(len(many), len(few))
+
+
+class PartitionedIntegrationTests(TestCase):
+
+    def setUp(self):
+        reload_fixture(WikipediaISOLanguage, "wikipedia.html")
+        reload_fixture(EthnologueLanguageCode, "LanguageCodes.tab")
+        reload_fixture(EthnologueCountryCode, "CountryCodes.tab")
+        reload_fixture(SIL_ISO_639_3, "iso_639_3.tab")
+        AdditionalLanguage.objects.create(ietf_tag="es-419", common_name="Spanish Latin America", native_name="Espanol")
+        update_countries_from_imports()
+
+    def test_partitions_cover_every_row_once(self):
+        rows = merged_language_rows()
+        partitions = [merged_language_rows(partition=(index, 3)) for index in range(3)]
+        self.assertEquals(sorted(r for partition in partitions for r in partition), rows)
+        for index, partition in enumerate(partitions):
+            self.assertTrue(all(partition_of(r[0], 3) == index for r in partition))
+
+    def test_full_integration_is_queued_per_partition(self):
+        languages = Language.objects.count()
+        with patch("td.tasks.chord") as chord:
+            integrate_imports(partitions=3)
+        self.assertEquals([sig.args for sig in chord.call_args[0][0]], [(0, 3, False), (1, 3, False), (2, 3, False)])
+        self.assertEquals(Language.objects.count(), languages)
+
+    def test_partitions_integrate_like_a_full_run(self):
+        languages = Language.objects.count()
+        with patch("td.tasks.languages_integrated") as languages_integrated:
+            results = [integrate_partition(index, 3) for index in range(3)]
+            self.assertFalse(languages_integrated.send.called)
+            finish_partitioned_integration(results)
+        languages_integrated.send.assert_called_once_with(sender=Language, full=True)
+        self.assertEquals(len(plan_languages(merged_language_rows())), 0)
+        self.assertEquals(Language.objects.get(code="aa").name, "Afaraf")
+        extra = Log.objects.filter(action="INTEGRATED_SOURCE_DATA").latest("timestamp").extra
+        self.assertEquals(extra["languages_created"], Language.objects.count() - languages)
+        self.assertEquals(len(extra["partition_seconds"]), 3)
+
+
+class CheckpointedIntegrationTests(TestCase):
+
+    def setUp(self):
+        reload_fixture(WikipediaISOLanguage, "wikipedia.html")
+        reload_fixture(EthnologueLanguageCode, "LanguageCodes.tab")
+        reload_fixture(EthnologueCountryCode, "CountryCodes.tab")
+        reload_fixture(SIL_ISO_639_3, "iso_639_3.tab")
+        AdditionalLanguage.objects.create(ietf_tag="es-419", common_name="Spanish Latin America", native_name="Espanol")
+        update_countries_from_imports()
+        Language.objects.all().delete()
+        self.rows = merged_language_rows()
+        self.codes = sorted({r[0] for r in self.rows})
+
+    def crash_after(self, chunks):
+        calls = []
+
+        def apply(plan):
+            if len(calls) == chunks:
+                raise RuntimeError("crashed")
+            calls.append(plan)
+            apply_language_plan(plan)
+        return patch("td.integration.apply_language_plan", side_effect=apply)
+
+    def test_interrupted_run_resumes_from_checkpoint(self):
+        with self.crash_after(1), self.assertRaises(RuntimeError):
+            integrate_in_chunks(self.rows, "languages", chunk_size=1)
+        checkpoint = IntegrationCheckpoint.objects.get(name="languages")
+        self.assertEquals(checkpoint.last_code, self.codes[0])
+        self.assertEquals(list(Language.objects.values_list("code", flat=True)), self.codes[:1])
+        with patch("td.integration.apply_language_plan", wraps=apply_language_plan) as apply:
+            checkpoint = integrate_in_chunks(self.rows, "languages", chunk_size=1, resume=True)
+        self.assertEquals(apply.call_count, len(self.codes) - 1)
+        self.assertEquals(checkpoint.languages_created, len(self.codes))
+        self.assertEquals(sorted(Language.objects.values_list("code", flat=True)), self.codes)
+        self.assertFalse(IntegrationCheckpoint.objects.exists())
+
+    def test_without_resume_starts_over(self):
+        with self.crash_after(1), self.assertRaises(RuntimeError):
+            integrate_in_chunks(self.rows, "languages", chunk_size=1)
+        checkpoint = integrate_in_chunks(self.rows, "languages", chunk_size=1)
+        self.assertEquals(checkpoint.languages_created, len(self.codes) - 1)
+        self.assertEquals(checkpoint.languages_updated, 0)
+        self.assertEquals(sorted(Language.objects.values_list("code", flat=True)), self.codes)
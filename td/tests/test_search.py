@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import json
+
+from django.test import TestCase
+
+from mock import patch
+
+from ..models import Country, Language, Region
+from ..search import LanguageIndex, cached_names_data, cached_names_json, langnames, language_index
+from .test_caching import CachedDatasetTestMixin
+
+
+def language(lc, ln, cc="", lr=""):
+    return dict(pk=None, lc=lc, ln=ln.encode("utf-8"), cc=[cc], lr=lr, gw=False, ld="ltr")
+
+
+class LanguageIndexTests(TestCase):
+
+    def setUp(self):
+        self.index = LanguageIndex([
+            language("de", u"German", "DE", "Europe"),
+            language("en", u"English", "GB", "Europe"),
+            language("eng-x-test", u"Engish Test"),
+            language("enq", u"Enga", "PG", "Pacific"),
+            language("pdc", u"Pennsylvania Deitsch", "US", "Americas"),
+            language("zza", u"Zaza", "TR", "Asia"),
+            language("zzz", u"Dengese", "CD", "Africa"),
+            language("zzy", u"Ñengatú", "BR", "Americas"),
+        ])
+
+    def codes(self, term):
+        return [x["lc"] for x in self.index.search(term)]
+
+    def test_short_terms_match_code_prefixes_then_country_codes(self):
+        self.assertEquals(self.codes("en"), ["en", "eng-x-test", "enq"])
+        self.assertEquals(self.codes("de"), ["de"])
+        self.assertEquals(self.codes("us"), ["pdc"])
+        self.assertEquals(self.codes("E"), ["en", "eng-x-test", "enq"])
+
+    def test_longer_terms_match_substrings_of_codes_names_and_regions(self):
+        self.assertEquals(self.codes("x-t"), ["eng-x-test"])
+        self.assertEquals(self.codes("americas"), ["pdc", "zzy"])
+        self.assertEquals(self.codes("sylvania dei"), ["pdc"])
+        self.assertEquals(self.codes("eitsch"), ["pdc"])
+
+    def test_matches_are_ranked_and_listed_once(self):
+        # code, then name prefixes, then other substrings
+        self.assertEquals(self.codes("eng"), ["eng-x-test", "en", "enq", "zzz", "zzy"])
+        self.assertEquals(self.codes("zza"), ["zza"])
+
+    def test_names_are_matched_ignoring_case(self):
+        self.assertEquals(self.codes(u"ÑENG"), ["zzy"])
+
+
+class LanguageIndexCacheTests(CachedDatasetTestMixin, TestCase):
+
+    def setUp(self):
+        super(LanguageIndexCacheTests, self).setUp()
+        patcher = patch("td.search._index", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_index_is_rebuilt_for_a_new_version(self):
+        with patch("td.models.Language.names_data", return_value=[language("aa", u"Afar")]):
+            index = language_index()
+            self.assertIs(language_index(), index)
+        with patch("td.models.Language.names_data", return_value=[language("ab", u"Abkhaz")]):
+            self.assertIs(language_index(), index)
+            langnames.invalidate()
+            self.assertEquals([x["lc"] for x in language_index().search("a")], ["ab"])
+
+
+class NamesDataTests(CachedDatasetTestMixin, TestCase):
+
+    def setUp(self):
+        super(NamesDataTests, self).setUp()
+        country = Country.objects.create(code="ZZ", name="Zedland", region=Region.objects.create(name="Zedlands"))
+        Language.objects.create(code="zza", name=u"Zazaki", country=country, direction="r", gateway_flag=True)
+        Language.objects.create(code="zzb", name=u"Zéb")
+
+    def names_data(self):
+        return [x for x in Language.names_data() if x["lc"] in ["zza", "zzb"]]
+
+    def test_names_data_takes_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.names_data()
+        self.assertEquals(data, [
+            dict(pk=data[0]["pk"], lc="zza", ln="Zazaki", cc=["ZZ"], lr="Zedlands", gw=True, ld="rtl"),
+            dict(pk=data[1]["pk"], lc="zzb", ln=u"Zéb".encode("utf-8"), cc=[""], lr="", gw=False, ld="ltr"),
+        ])
+
+    def test_cached_forms(self):
+        data = Language.names_data()
+        with self.assertNumQueries(1):
+            blob, version = cached_names_json()
+            self.assertEquals(blob, json.dumps(data))
+        with self.assertNumQueries(0):
+            cached, cached_version = cached_names_data()
+            self.assertEquals(cached_names_json(), (blob, version))
+        self.assertEquals(cached_version, version)
+        self.assertEquals(cached, data)
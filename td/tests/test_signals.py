@@ -0,0 +1,146 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from mock import Mock, patch
+
+from ..middleware import DeferredSignalsMiddleware
+from ..models import Country, Language, LanguageEAV
+from ..signals import begin_deferred, deferred_signals, deferring
+
+
+class DeferredSignalsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("editor", "editor@example.com", "secret")
+        self.languages = [Language.objects.create(code=code, name=code) for code in ["aa", "ab", "ae"]]
+
+    def attributes(self):
+        return LanguageEAV.objects.filter(entity__in=self.languages)
+
+    def test_invalidations_and_provenance_are_flushed_once(self):
+        with patch("td.receivers.langnames") as langnames, patch("td.receivers.map_gateways") as map_gateways:
+            with deferred_signals() as deferred:
+                for language in self.languages:
+                    language.direction = "r"
+                    language.source = self.user
+                    language.save()
+                Country.objects.create(code="ZZ", name="Zedland")
+                self.assertFalse(langnames.invalidate.called)
+                self.assertFalse(self.attributes().exists())
+        langnames.invalidate.assert_called_once_with()
+        map_gateways.invalidate.assert_called_once_with()
+        self.assertEquals(
+            sorted(self.attributes().values_list("entity__code", "attribute", "value")),
+            [("aa", "direction", "r"), ("ab", "direction", "r"), ("ae", "direction", "r")]
+        )
+        # 11 invalidations of the language list, map and country tree and 3
+        # provenance records, written as 3 invalidations and 1 insert
+        self.assertEquals(deferred.events, 14)
+        self.assertEquals(deferred.coalesced, 10)
+
+    def test_provenance_is_dropped_on_error(self):
+        with patch("td.receivers.langnames") as langnames:
+            with self.assertRaises(ValueError):
+                with deferred_signals():
+                    self.languages[0].direction = "r"
+                    self.languages[0].source = self.user
+                    self.languages[0].save()
+                    raise ValueError
+        self.assertTrue(langnames.invalidate.called)
+        self.assertFalse(self.attributes().exists())
+
+    def test_committed_provenance_is_kept_on_error(self):
+        with patch("td.signals.connection", Mock(in_atomic_block=False)):
+            with self.assertRaises(ValueError):
+                with deferred_signals():
+                    self.languages[0].direction = "r"
+                    self.languages[0].source = self.user
+                    self.languages[0].save()
+                    raise ValueError
+        self.assertEquals(list(self.attributes().values_list("attribute", "value")), [("direction", "r")])
+
+    def test_nested_blocks_join_the_outer_one(self):
+        with patch("td.receivers.langnames") as langnames:
+            with deferred_signals() as outer:
+                with deferred_signals() as inner:
+                    self.languages[0].save()
+                self.assertIs(inner, outer)
+                self.assertFalse(langnames.invalidate.called)
+                self.languages[1].save()
+        langnames.invalidate.assert_called_once_with()
+
+
+class ProvenanceWriterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("editor", "editor@example.com", "secret")
+        self.language = Language.objects.create(code="aa", name="Afar")
+
+    def test_fields_of_a_save_are_written_together(self):
+        self.language.name = "Afaraf"
+        self.language.direction = "r"
+        self.language.gateway_flag = True
+        self.language.source = self.user
+        with CaptureQueriesContext(connection) as queries:
+            self.language.save()
+        self.assertEquals(len([q for q in queries.captured_queries if "uw_languageeav" in q["sql"]]), 1)
+        self.assertEquals(
+            sorted(self.language.attributes.values_list("attribute", "value")),
+            [("direction", "r"), ("gateway_flag", "True"), ("name", "Afaraf")]
+        )
+
+    def test_request_writes_provenance_once(self):
+        middleware = DeferredSignalsMiddleware()
+        request = RequestFactory().post("/")
+        middleware.process_request(request)
+        for name in ["Afaraf", "Qafar af"]:
+            self.language.name = name
+            self.language.source = self.user
+            self.language.save()
+        self.assertFalse(self.language.attributes.exists())
+        with CaptureQueriesContext(connection) as queries:
+            middleware.process_response(request, HttpResponse())
+        self.assertEquals(len([q for q in queries.captured_queries if "uw_languageeav" in q["sql"]]), 1)
+        self.assertEquals(
+            list(self.language.attributes.order_by("pk").values_list("value", flat=True)),
+            ["Afaraf", "Qafar af"]
+        )
+
+    def fail_request(self, name="Afaraf", response=None):
+        middleware = DeferredSignalsMiddleware()
+        request = RequestFactory().post("/")
+        middleware.process_request(request)
+        self.language.name = name
+        self.language.source = self.user
+        self.language.save()
+        if response is None:
+            middleware.process_exception(request, ValueError())
+            response = HttpResponse(status=500)
+        middleware.process_response(request, response)
+
+    def test_failed_atomic_request_drops_provenance(self):
+        with patch.dict(connection.settings_dict, {"ATOMIC_REQUESTS": True}):
+            self.fail_request()
+        self.assertFalse(self.language.attributes.exists())
+
+    def test_failed_request_keeps_committed_provenance(self):
+        with patch.dict(connection.settings_dict, {"ATOMIC_REQUESTS": False}):
+            self.fail_request()
+        with patch.dict(connection.settings_dict, {"ATOMIC_REQUESTS": True}):
+            self.fail_request("Qafar af", HttpResponse(status=500))
+        self.assertEquals(
+            list(self.language.attributes.order_by("pk").values_list("value", flat=True)),
+            ["Afaraf", "Qafar af"]
+        )
+
+    def test_request_starts_a_fresh_deferral(self):
+        leaked, _ = begin_deferred()
+        middleware = DeferredSignalsMiddleware()
+        request = RequestFactory().get("/")
+        middleware.process_request(request)
+        self.assertIsNot(deferring(), leaked)
+        middleware.process_response(request, HttpResponse())
+        self.assertIsNone(deferring())
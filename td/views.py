@@ -4,13 +4,14 @@ from account.decorators import login_required
 from account.mixins import LoginRequiredMixin
 from pinax.eventlog.mixins import EventLogMixin
 from django.contrib import messages
-from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.db.models import Q
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import redirect, render, get_object_or_404
 from django.views.generic import TemplateView, ListView, DetailView, UpdateView, CreateView
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 
 from td.imports.models import (
     EthnologueCountryCode,
@@ -23,31 +24,50 @@ from td.imports.models import (
 from td.models import Language, Country, Region, Network
 from .models import AdditionalLanguage
 from td.forms import NetworkForm, CountryForm, LanguageForm, UploadGatewayForm
-from td.resources.models import transform_country_data
-from td.resources.tasks import get_map_gateways
+from td.resources.tasks import get_country_tree, get_map_gateways
 from td.resources.views import EntityTrackingMixin
+from .exports import accepted_encoding, export_artifact, export_body
+from .search import language_index
+from .signals import deferred_signals
 from .utils import DataTableSourceView, svg_to_pdf
 
 
+def _export(request, name):
+    if not hasattr(request, "export_artifact"):
+        request.export_artifact = export_artifact(name)
+    return request.export_artifact
+
+
+def _export_etag(request, name):
+    artifact = _export(request, name)
+    return "{0}-{1}".format(artifact["version"], accepted_encoding(request, artifact["encodings"]))
+
+
+def _export_last_modified(request, name):
+    return _export(request, name)["modified"]
+
+
+@vary_on_headers("Accept-Encoding")
+@condition(etag_func=_export_etag, last_modified_func=_export_last_modified)
+def _export_response(request, name):
+    artifact = _export(request, name)
+    encoding = accepted_encoding(request, artifact["encodings"])
+    response = HttpResponse(export_body(artifact, encoding), content_type=artifact["content_type"])
+    if encoding != "identity":
+        response["Content-Encoding"] = encoding
+    return response
+
+
 def codes_text_export(request):
-    return HttpResponse(Language.codes_text(), content_type="text/plain")
+    return _export_response(request, "codes-d43.txt")
 
 
 def names_text_export(request):
-    return HttpResponse(Language.names_text(), content_type="text/plain")
+    return _export_response(request, "langnames.txt")
 
 
 def names_json_export(request):
-    data = cache_get_or_set("langnames", Language.names_data)
-    return JsonResponse(data, safe=False)  # Set safe to False to allow list instead of dict to be returned
-
-
-def cache_get_or_set(key, acallable):
-    data = cache.get(key)
-    if data is None:
-        data = acallable()
-        cache.set(key, data, None)
-    return data
+    return _export_response(request, "langnames.json")
 
 
 @csrf_exempt
@@ -61,30 +81,7 @@ def export_svg(request):
 
 def languages_autocomplete(request):
     term = request.GET.get("q").lower()
-    data = cache_get_or_set("langnames", Language.names_data)
-    d = []
-    if len(term) <= 3:
-        term = term.encode("utf-8")
-        # search: cc, lc
-        # first do a *starts with* style search of language code (lc)
-        d.extend([
-            x
-            for x in data
-            if term == x["lc"].lower()[:len(term)]
-        ])
-        d.extend([
-            x
-            for x in data
-            if term in [y.lower() for y in x["cc"]]
-        ])
-    if len(term) >= 3:
-        # search: lc, ln, lr
-        term = term.encode("utf-8")
-        d.extend([
-            x
-            for x in data
-            if term in x["lc"] or term in x["ln"].lower() or term in x["lr"].lower()
-        ])
+    d = language_index().search(term)
     return JsonResponse({"results": d, "count": len(d), "term": term})
 
 
@@ -213,7 +210,7 @@ class AjaxIMBPeopleGroupListView(DataTableSourceView):
 
 @login_required
 def country_tree_data(request):
-    return JsonResponse(transform_country_data(Country.gateway_data()))
+    return JsonResponse(get_country_tree())
 
 
 def country_map_data(request):
@@ -261,10 +258,11 @@ def upload_gateway_flag_file(request):
     if request.method == "POST":
         form = UploadGatewayForm(request.POST, request.FILES)
         if form.is_valid():
-            for lang in Language.objects.filter(code__in=form.cleaned_data["languages"]):
-                lang.gateway_flag = True
-                lang.source = request.user
-                lang.save()
+            with deferred_signals():
+                for lang in Language.objects.filter(code__in=form.cleaned_data["languages"]):
+                    lang.gateway_flag = True
+                    lang.source = request.user
+                    lang.save()
             messages.add_message(request, messages.SUCCESS, "Gateway languages updated")
             return redirect("gateway_flag_update")
     else:
@@ -284,10 +282,11 @@ def upload_rtl_list(request):
     if request.method == "POST":
         form = UploadGatewayForm(request.POST)
         if form.is_valid():
-            for lang in Language.objects.filter(code__in=form.cleaned_data["languages"]):
-                lang.direction = "r"
-                lang.source = request.user
-                lang.save()
+            with deferred_signals():
+                for lang in Language.objects.filter(code__in=form.cleaned_data["languages"]):
+                    lang.direction = "r"
+                    lang.source = request.user
+                    lang.save()
             messages.add_message(request, messages.SUCCESS, "RTL languages updated")
             return redirect("rtl_languages_update")
     else: